@@ -8,6 +8,33 @@ class Settings(BaseSettings):
     gcp_location: str
     gemini_model_name: str
 
+    # Seconds to wait for a model before also starting the next fallback model (hedged request); 0 sends
+    # every request to all models at once and keeps the first answer
+    gemini_hedge_delay_seconds: float = 8.0
+
+    # Send classify-and-verify requests to every model at once and keep the most confident answer, trading
+    # extra Gemini calls for not waiting on a fallback after a failed or low-confidence first answer
+    gemini_speculative_fallback: bool = False
+
+    # Seconds to hold initial-classification requests so that those arriving together share one Gemini call
+    # (0 disables batching), and the most requests combined into one call
+    initial_classification_batch_window_seconds: float = 0.0
+    initial_classification_batch_size: int = 8
+
+    # Send one minimal (billed) request to each model at startup, so the first real request finds its
+    # connection open
+    gemini_warm_up_requests: bool = False
+
+    # Maximum number of Gemini calls in flight at once across all requests
+    gemini_max_concurrency: int = 16
+
+    # Minimum confidence at which a local text classification is returned without calling Gemini
+    local_classifier_min_confidence: float = 0.95
+
+    # Cloud Storage bucket for document images (optional). When set, each distinct image is uploaded
+    # once, keyed by its SHA-256, and sent to Gemini by gs:// reference instead of inline base64
+    gcs_image_bucket: Optional[str] = None
+
     # Legacy path to service account key file (optional)
     google_application_credentials: Optional[str] = None
 
@@ -0,0 +1,43 @@
+import re
+from typing import Optional, Tuple
+
+# Header phrases and identifiers that only appear on one document type. Each entry is
+# (document_type, pattern, description); patterns run against case-folded document text.
+_MARKERS = (
+    ("SalesQuote", re.compile(r"\bsales\s+quote\b"), "'SALES QUOTE' header"),
+    ("SalesQuote", re.compile(r"\bsq\d{5,}\b"), "SQ quote number"),
+    ("SalesQuote", re.compile(r"pay\s+via\s+mpesa"), "Mpesa payment option"),
+    ("ProformaInvoice", re.compile(r"\bpro\s*-?\s*forma\s+invoice\b"), "'PRO FORMA INVOICE' header"),
+    ("ProformaInvoice", re.compile(r"this\s+is\s+not\s+a\s+tax\s+invoice"), "'not a Tax Invoice' notice"),
+    ("JobConsumption", re.compile(r"\bjob\s+shipment\b"), "'JOB SHIPMENT' header"),
+    ("JobConsumption", re.compile(r"\binstructed\s+by\b"), "'INSTRUCTED BY' section"),
+    ("JobConsumption", re.compile(r"\bdispatched\s+by\b"), "'DISPATCHED BY' section"),
+)
+
+# Confidence reported when a single type matched, by number of distinct markers found
+_SINGLE_MARKER_CONFIDENCE = 0.9
+_MULTI_MARKER_CONFIDENCE = 0.97
+
+
+def classify_text(text: Optional[str]) -> Optional[Tuple[str, float, str]]:
+    """
+    Classifies a document from its text using the header phrases that identify each type.
+    Returns (document_type, confidence, reasoning), or None when no marker matched or the
+    markers point at more than one type.
+    """
+    if not text:
+        return None
+
+    folded_text = text.casefold()
+    matches = {}
+    for document_type, pattern, description in _MARKERS:
+        if pattern.search(folded_text):
+            matches.setdefault(document_type, []).append(description)
+
+    if len(matches) != 1:
+        return None
+
+    document_type, descriptions = next(iter(matches.items()))
+    confidence = _MULTI_MARKER_CONFIDENCE if len(descriptions) > 1 else _SINGLE_MARKER_CONFIDENCE
+    reasoning = "Matched locally on document text: " + ", ".join(descriptions)
+    return document_type, confidence, reasoning
@@ -1,6 +1,11 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from contextlib import asynccontextmanager
+from typing import List
+import asyncio
 import logging
+import os
+
+import orjson
 
 from . import schemas, services, config
 
@@ -14,9 +19,19 @@ async def lifespan(app: FastAPI):
     # Code to run on startup
     logger.info("Application startup...")
     services.init_vertexai() # Initialize Vertex AI client
+    services.warm_up_models() # Create the shared Gemini clients before the first request
+    credentials_refresh_task = asyncio.create_task(services.refresh_credentials_periodically())
+    # Open the clients' connections in the background, so startup does not wait on Gemini
+    warm_up_task = None
+    if config.settings.gemini_warm_up_requests:
+        warm_up_task = asyncio.create_task(services.send_warm_up_requests())
     yield
     # Code to run on shutdown (if any)
     logger.info("Application shutdown...")
+    credentials_refresh_task.cancel()
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await services.close_models()
 
 app = FastAPI(
     title="AI Document Verification Microservice (Gemini)",
@@ -45,6 +60,38 @@ async def extract_identifiers(request: schemas.IdentifierExtractionRequest):
         logger.error(f"Unhandled exception in /extract_identifiers endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@app.post("/extract_identifiers_batch", response_model=schemas.IdentifierExtractionBatchResponse)
+async def extract_identifiers_batch(request: schemas.IdentifierExtractionBatchRequest):
+    """
+    Submits identifier extraction for several documents as a discounted, asynchronous Gemini batch job.
+    """
+    logger.info(f"Received request for /extract_identifiers_batch with {len(request.requests)} documents")
+    try:
+        response_data = await services.submit_identifier_extraction_batch(request.requests)
+        if response_data.error_message:
+            logger.error(f"Error in submit_identifier_extraction_batch: {response_data.error_message}")
+            raise HTTPException(status_code=500, detail=response_data.error_message)
+        return response_data
+    except Exception as e:
+        logger.error(f"Unhandled exception in /extract_identifiers_batch endpoint: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.get("/extract_identifiers_batch/{job_id}", response_model=schemas.IdentifierExtractionBatchResponse)
+async def get_extract_identifiers_batch(job_id: str):
+    """
+    Returns the state of a batch identifier extraction job, with its results once it has succeeded.
+    """
+    logger.info(f"Received request for /extract_identifiers_batch/{job_id}")
+    try:
+        response_data = await services.collect_identifier_extraction_batch(job_id)
+        if response_data.error_message and not response_data.state:
+            logger.error(f"Error in collect_identifier_extraction_batch: {response_data.error_message}")
+            raise HTTPException(status_code=500, detail=response_data.error_message)
+        return response_data
+    except Exception as e:
+        logger.error(f"Unhandled exception in /extract_identifiers_batch/{job_id} endpoint: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
 @app.post("/verify_document", response_model=schemas.VerificationResponse)
 async def verify_document(request: schemas.VerificationRequest):
     """
@@ -62,6 +109,22 @@ async def verify_document(request: schemas.VerificationRequest):
         logger.error(f"Unhandled exception in /verify_document endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@app.post("/verify_documents", response_model=schemas.BatchVerificationResponse)
+async def verify_documents(request: schemas.BatchVerificationRequest):
+    """
+    Verifies several documents against ERP data in bundled Gemini calls. Results are returned in request order.
+    """
+    logger.info(f"Received request for /verify_documents with {len(request.documents)} documents")
+    try:
+        results = await services.verify_documents_with_gemini(request.documents)
+        if results and all(result.error_message and not (result.discrepancies or result.field_confidences) for result in results):
+            logger.error(f"Error in verify_documents_with_gemini: {results[0].error_message}")
+            raise HTTPException(status_code=500, detail=results[0].error_message)
+        return schemas.BatchVerificationResponse(results=results)
+    except Exception as e:
+        logger.error(f"Unhandled exception in /verify_documents endpoint: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
 @app.post("/classify_document", response_model=schemas.ClassificationResponse)
 async def classify_document(request: schemas.ClassificationRequest):
     """
@@ -78,6 +141,22 @@ async def classify_document(request: schemas.ClassificationRequest):
         logger.error(f"Unhandled exception in /classify_document endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@app.post("/classify_documents", response_model=schemas.BatchClassificationResponse)
+async def classify_documents(request: schemas.BatchClassificationRequest):
+    """
+    Classifies several documents in batched Gemini calls. Results are returned in request order.
+    """
+    logger.info(f"Received request for /classify_documents with {len(request.documents)} documents")
+    try:
+        results = await services.classify_documents_with_gemini(request.documents)
+        if results and all(result.error_message for result in results):
+            logger.error(f"Error in classify_documents_with_gemini: {results[0].error_message}")
+            raise HTTPException(status_code=500, detail=results[0].error_message)
+        return schemas.BatchClassificationResponse(results=results)
+    except Exception as e:
+        logger.error(f"Unhandled exception in /classify_documents endpoint: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
 @app.post("/classify_and_verify", response_model=schemas.ClassifyAndVerifyResponse)
 async def classify_and_verify(request: schemas.ClassifyAndVerifyRequest):
     """
@@ -97,6 +176,31 @@ async def classify_and_verify(request: schemas.ClassifyAndVerifyRequest):
         logger.error(f"Unhandled exception in /classify_and_verify endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@app.post("/classify_and_verify/upload", response_model=schemas.ClassifyAndVerifyResponse)
+async def classify_and_verify_upload(
+    job_no: str = Form(...),
+    erp_data: str = Form(..., description="ERP data as a JSON object"),
+    files: List[UploadFile] = File(..., description="Document page images")
+):
+    """
+    Same as /classify_and_verify, but takes the page images as multipart file uploads instead of
+    base64 strings, avoiding the base64 size overhead and the decode step.
+    """
+    logger.info(f"Received request for /classify_and_verify/upload for job_no: {job_no} with {len(files)} files")
+    try:
+        erp_data_dict = orjson.loads(erp_data)
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"erp_data is not valid JSON: {e}")
+    if not isinstance(erp_data_dict, dict):
+        raise HTTPException(status_code=400, detail="erp_data must be a JSON object")
+
+    document_images = [
+        schemas.DocumentImage.from_bytes(await file.read(), file.content_type or "image/png")
+        for file in files
+    ]
+    request = schemas.ClassifyAndVerifyRequest(job_no=job_no, document_images=document_images, erp_data=erp_data_dict)
+    return await classify_and_verify(request)
+
 @app.get("/health", summary="Health Check")
 def health_check():
     """
@@ -123,7 +227,6 @@ def health_check():
         credentials_type = "service_account_env"
     # Check if service account credentials file exists (legacy method)
     elif config.settings.google_application_credentials:
-        import os
         if os.path.exists(config.settings.google_application_credentials):
             credentials_status = "available"
             credentials_message = f"Service account credentials found at: {config.settings.google_application_credentials}"
@@ -1,24 +1,55 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 from typing import List, Dict, Any, Optional
 
 class DocumentImage(BaseModel):
-    image_base64: str = Field(description="Base64 encoded string of the document image.")
+    image_base64: Optional[str] = Field(default=None, description="Base64 encoded string of the document image.")
     mime_type: str = Field(default="image/png", description="MIME type of the image (e.g., image/png, image/jpeg).")
+    # Raw image bytes for images uploaded as multipart files; never part of the JSON schema
+    _raw_bytes: Optional[bytes] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, mime_type: str) -> "DocumentImage":
+        """Wraps raw image bytes, e.g. from a multipart upload, without base64 encoding them."""
+        # Constructed without validation: the bytes stand in for the base64 data the validator requires
+        image = cls.model_construct(mime_type=mime_type)
+        image._raw_bytes = data
+        return image
+
+    @model_validator(mode="after")
+    def _require_image_data(self) -> "DocumentImage":
+        """Requires exactly one source of image data: base64 in JSON, or raw bytes from from_bytes."""
+        if (self.image_base64 is None) == (self._raw_bytes is None):
+            raise ValueError("Exactly one of image_base64 or uploaded image bytes must be provided")
+        return self
+
+    @property
+    def raw_bytes(self) -> Optional[bytes]:
+        return self._raw_bytes
 
 class IdentifierExtractionRequest(BaseModel):
     job_no: str
     document_type: str
     document_images: List[DocumentImage]
 
+class IdentifierExtractionBatchRequest(BaseModel):
+    requests: List[IdentifierExtractionRequest]
+
 class VerificationRequest(BaseModel):
     job_no: str
     document_type: str
     document_images: List[DocumentImage]
     erp_data: Dict[str, Any] # Represents the structured BC data
 
+class BatchVerificationRequest(BaseModel):
+    documents: List[VerificationRequest]
+
 class ClassificationRequest(BaseModel):
     job_no: str
     document_images: List[DocumentImage]
+    document_text: Optional[str] = Field(default=None, description="OCR text of the document, if the caller already has it; lets obvious documents be classified without calling Gemini.")
+
+class BatchClassificationRequest(BaseModel):
+    documents: List[ClassificationRequest]
 
 class ClassifyAndVerifyRequest(BaseModel):
     job_no: str
@@ -31,6 +62,12 @@ class IdentifierExtractionResponse(BaseModel):
     extracted_identifiers: Dict[str, str]
     error_message: Optional[str] = None # Optional field for errors
 
+class IdentifierExtractionBatchResponse(BaseModel):
+    job_id: Optional[str] = Field(default=None, description="Vertex AI batch prediction job ID to poll for results")
+    state: Optional[str] = Field(default=None, description="Batch job state, e.g. JOB_STATE_RUNNING or JOB_STATE_SUCCEEDED")
+    results: List[IdentifierExtractionResponse] = Field(default_factory=list, description="One result per submitted request, in submission order, once the job has succeeded")
+    error_message: Optional[str] = None # Optional field for errors
+
 class Discrepancy(BaseModel):
     field_name: str
     document_value: Optional[str] = None # Made Optional
@@ -59,12 +96,18 @@ class VerificationResponse(BaseModel):
     raw_llm_response: Optional[str] = None # For debugging
     error_message: Optional[str] = None # Optional field for errors
 
+class BatchVerificationResponse(BaseModel):
+    results: List[VerificationResponse] = Field(default_factory=list, description="One verification per requested document, in request order")
+
 class ClassificationResponse(BaseModel):
     document_type: str = Field(description="The classified document type (SalesQuote, ProformaInvoice, JobConsumption, or UNKNOWN)")
     confidence: float = Field(default=0.0, description="A confidence score between 0.0 and 1.0")
     reasoning: Optional[str] = Field(default=None, description="Brief explanation of why this classification was chosen")
     error_message: Optional[str] = None # Optional field for errors
 
+class BatchClassificationResponse(BaseModel):
+    results: List[ClassificationResponse] = Field(default_factory=list, description="One classification per requested document, in request order")
+
 class ClassifyAndVerifyResponse(BaseModel):
     document_type: str = Field(description="The classified document type (SalesQuote, ProformaInvoice, JobConsumption, or UNKNOWN)")
     classification_confidence: float = Field(default=0.0, description="A confidence score between 0.0 and 1.0 for classification")
@@ -1,38 +1,64 @@
-import base64
-import json
-from typing import List, Dict, Any
+import asyncio
+import binascii
+import datetime
+import functools
+import hashlib
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple, TypeVar
 import logging
 
+import orjson
+from pydantic import ValidationError
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part, Image, GenerationConfig # Added GenerationConfig
+from google.api_core import exceptions as api_exceptions
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud import storage
+from vertexai.batch_prediction import BatchPredictionJob
+from vertexai.generative_models import Content, GenerativeModel, Part, GenerationConfig # Added GenerationConfig
+import google.auth
+import google.auth.credentials
+import google.auth.transport.requests
 from google.auth.exceptions import DefaultCredentialsError
+from google.oauth2 import service_account
 
 
 from .config import settings
 from . import schemas
+from . import local_classifier
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO) # Adjust log level as needed
 
+T = TypeVar("T")
+
 # --- Vertex AI Initialization ---
 _vertex_ai_initialized = False
 
+# Credentials Vertex AI was initialized with, shared with the other Google Cloud clients. They are
+# created already scoped so the client libraries use this object as-is rather than a scoped copy,
+# which lets refresh_credentials_periodically keep the token fresh outside the request path.
+_credentials: Optional[google.auth.credentials.Credentials] = None
+_CLOUD_PLATFORM_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+# How long before expiry the access token is refreshed in the background
+_CREDENTIALS_REFRESH_MARGIN_SECONDS = 300
+
 def init_vertexai():
     """
     Initializes the Vertex AI client.
     Should be called once on application startup.
     """
-    global _vertex_ai_initialized
+    global _vertex_ai_initialized, _credentials
     if _vertex_ai_initialized:
         logger.info("Vertex AI already initialized.")
         return
 
     try:
         logger.info(f"Initializing Vertex AI with Project ID: {settings.gcp_project_id}, Location: {settings.gcp_location}")
-        from google.oauth2 import service_account
-        import json
-        import tempfile
 
         # Check if service account credentials are provided via environment variables
         if settings.has_service_account_env_vars():
@@ -53,9 +79,10 @@ def init_vertexai():
                 }
 
                 # Create credentials from the service account info
-                credentials = service_account.Credentials.from_service_account_info(service_account_info)
+                credentials = service_account.Credentials.from_service_account_info(service_account_info, scopes=_CLOUD_PLATFORM_SCOPES)
                 vertexai.init(project=settings.gcp_project_id, location=settings.gcp_location, credentials=credentials)
                 logger.info("Vertex AI initialized using service account credentials from environment variables.")
+                _credentials = credentials
                 _vertex_ai_initialized = True
             except Exception as e:
                 logger.error(f"Failed to initialize Vertex AI with service account credentials from environment variables: {e}", exc_info=True)
@@ -63,7 +90,6 @@ def init_vertexai():
 
         # Check if credentials file exists when specified (legacy method)
         elif settings.google_application_credentials:
-            import os
             if not os.path.exists(settings.google_application_credentials):
                 logger.error(f"Service account credentials file not found at: {settings.google_application_credentials}")
                 logger.error("Please place a valid service account key file at this location or update the GOOGLE_APPLICATION_CREDENTIALS path in .env")
@@ -71,9 +97,10 @@ def init_vertexai():
                 return
 
             try:
-                credentials = service_account.Credentials.from_service_account_file(settings.google_application_credentials)
+                credentials = service_account.Credentials.from_service_account_file(settings.google_application_credentials, scopes=_CLOUD_PLATFORM_SCOPES)
                 vertexai.init(project=settings.gcp_project_id, location=settings.gcp_location, credentials=credentials)
                 logger.info("Vertex AI initialized using service account credentials from file.")
+                _credentials = credentials
                 _vertex_ai_initialized = True
             except Exception as e:
                 logger.error(f"Failed to initialize Vertex AI with service account credentials from file: {e}", exc_info=True)
@@ -81,8 +108,10 @@ def init_vertexai():
         else:
             # Relies on Application Default Credentials (ADC)
             try:
-                vertexai.init(project=settings.gcp_project_id, location=settings.gcp_location)
+                credentials, _ = google.auth.default(scopes=_CLOUD_PLATFORM_SCOPES)
+                vertexai.init(project=settings.gcp_project_id, location=settings.gcp_location, credentials=credentials)
                 logger.info("Vertex AI initialized using Application Default Credentials (ADC).")
+                _credentials = credentials
                 _vertex_ai_initialized = True
             except DefaultCredentialsError:
                 logger.error(
@@ -99,17 +128,182 @@ def init_vertexai():
         logger.error(f"Failed to initialize Vertex AI: {e}", exc_info=True)
         _vertex_ai_initialized = False
 
+async def refresh_credentials_periodically() -> None:
+    """
+    Refreshes the shared access token shortly before it expires, so requests never wait on an
+    in-band token refresh. Runs until cancelled; started and stopped by the application lifespan.
+    """
+    while _credentials is not None:
+        expiry = _credentials.expiry
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) # google-auth uses naive UTC
+        if not _credentials.valid or expiry is None or (expiry - now).total_seconds() < _CREDENTIALS_REFRESH_MARGIN_SECONDS:
+            try:
+                await asyncio.to_thread(_credentials.refresh, google.auth.transport.requests.Request())
+                logger.info(f"Refreshed Google Cloud access token, valid until {_credentials.expiry}")
+            except Exception as e:
+                logger.warning(f"Failed to refresh Google Cloud access token: {e}")
+                await asyncio.sleep(60)
+                continue
+            expiry = _credentials.expiry
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+        if expiry is None:
+            # Credentials without an expiry (e.g. self-signed JWTs) do not need refreshing
+            return
+        await asyncio.sleep(max((expiry - now).total_seconds() - _CREDENTIALS_REFRESH_MARGIN_SECONDS, 60))
+
 
 # --- Helper Functions ---
-def _build_gemini_parts_from_request(
+@functools.lru_cache(maxsize=8)
+def _get_model(model_name: str) -> GenerativeModel:
+    """Returns a shared GenerativeModel for model_name, created on first use."""
+    return GenerativeModel(model_name)
+
+# Models every Gemini call tries, in order of preference
+_MODEL_NAMES = (settings.gemini_model_name, "gemini-2.0-flash-lite-001")
+
+def warm_up_models() -> None:
+    """
+    Creates the shared models and their async prediction clients at startup, so the first request
+    does not pay for client and channel setup. Every later call reuses the same client and channel.
+    """
+    if not _vertex_ai_initialized:
+        return
+    for model_name in _MODEL_NAMES:
+        # A private cached_property of the SDK model; building it creates the gRPC transport used by
+        # generate_content_async. Read through getattr so an SDK without it only skips the warm-up.
+        getattr(_get_model(model_name), "_prediction_async_client", None)
+    logger.info(f"Prepared Gemini clients for models: {', '.join(_MODEL_NAMES)}")
+
+# A one-token answer is enough to open the connection behind each model
+_WARM_UP_GENERATION_CONFIG = GenerationConfig(temperature=0.0, max_output_tokens=1)
+
+async def send_warm_up_requests() -> None:
+    """
+    Sends one minimal request to each model, so the TLS session and gRPC channel of the shared clients
+    are open before the first real request. Failures are only logged; requests connect on demand anyway.
+    """
+    if not _vertex_ai_initialized:
+        return
+
+    async def warm_up(model_name: str) -> None:
+        try:
+            await _generate_content(_get_model(model_name), _as_user_contents([_text_part("ping")]), _WARM_UP_GENERATION_CONFIG)
+        except Exception as e:
+            logger.warning(f"Warm-up request to model {model_name} failed: {e}")
+
+    await asyncio.gather(*(warm_up(model_name) for model_name in _MODEL_NAMES))
+    logger.info(f"Sent warm-up requests to models: {', '.join(_MODEL_NAMES)}")
+
+async def close_models() -> None:
+    """Closes the shared models' gRPC channels at shutdown and empties the model cache."""
+    if _vertex_ai_initialized:
+        for model_name in _MODEL_NAMES:
+            # Private SDK method; an SDK without it leaves the channel to be closed at process exit
+            close_async_client = getattr(_get_model(model_name), "_close_async_client", None)
+            if close_async_client is None:
+                continue
+            try:
+                await close_async_client()
+            except Exception as e:
+                logger.warning(f"Failed to close Gemini client for model {model_name}: {e}")
+    _get_model.cache_clear()
+
+# Response schema for single-document classification. With a JSON response MIME type Gemini always
+# returns one object of this shape, so the answer is parsed directly rather than recovered from prose
+_CLASSIFICATION_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "documentType": {"type": "string", "enum": ["SalesQuote", "ProformaInvoice", "JobConsumption", "UNKNOWN"]},
+        "confidence": {"type": "number"},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["documentType", "confidence", "reasoning"],
+}
+
+# Generation parameters for single-document classification; GenerationConfig is never mutated
+_CLASSIFICATION_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1,
+    max_output_tokens=1024,
+    response_mime_type="application/json",
+    response_schema=_CLASSIFICATION_RESPONSE_SCHEMA
+)
+
+def _decode_image(doc_image: schemas.DocumentImage) -> bytes:
+    """
+    Returns the raw bytes of a document image. Images uploaded as multipart files already carry
+    them; base64 images are decoded with binascii, which accepts the ASCII str directly, unlike
+    base64.b64decode, which first copies the whole payload into an intermediate bytes object.
+    """
+    if doc_image.raw_bytes is not None:
+        return doc_image.raw_bytes
+    if doc_image.image_base64 is None:
+        raise ValueError("Document image has neither base64 data nor uploaded bytes")
+    return binascii.a2b_base64(doc_image.image_base64)
+
+@functools.lru_cache(maxsize=256)
+def _text_part(text: str) -> Part:
+    """
+    Returns a text Part for prompt text that repeats across requests (static instructions, document
+    markers), built once and shared. Parts are only read when a request is serialized, never mutated.
+    Request-specific prompts should use Part.from_text directly so they do not fill the cache.
+    """
+    return Part.from_text(text)
+
+async def _build_gemini_parts_from_request(
     prompt_text: str,
     document_images: List[schemas.DocumentImage]
 ) -> List[Part]:
     """Helper to build Parts for Gemini request from base64 images."""
-    parts = [Part.from_text(prompt_text)]
+    return [Part.from_text(prompt_text), *await _build_image_parts(document_images)]
+
+def _unique_images(document_images: List[schemas.DocumentImage]) -> List[schemas.DocumentImage]:
+    """
+    Drops repeated copies of the same image (e.g. a page scanned or attached twice), keeping the first.
+    Identical pages add prompt tokens without adding information, and each copy would be decoded again.
+    """
+    seen = set()
+    unique_images = []
     for doc_image in document_images:
+        key = (doc_image.raw_bytes if doc_image.raw_bytes is not None else doc_image.image_base64, doc_image.mime_type)
+        if key not in seen:
+            seen.add(key)
+            unique_images.append(doc_image)
+    if len(unique_images) < len(document_images):
+        logger.info(f"Dropped {len(document_images) - len(unique_images)} duplicate image(s) from the request")
+    return unique_images
+
+def _lru_get(cache: "OrderedDict[Any, T]", key: Any) -> Optional[T]:
+    """Returns the cached value for key, if any, marking it as the most recently used."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _lru_put(cache: "OrderedDict[Any, T]", key: Any, value: T, max_entries: int) -> None:
+    """Caches value under key, evicting the least recently used entry once the cache is full."""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > max_entries:
+        cache.popitem(last=False)
+
+async def _build_image_parts(document_images: List[schemas.DocumentImage]) -> List[Part]:
+    """
+    Helper to build image Parts for Gemini request from base64 images.
+    When settings.gcs_image_bucket is set, images are referenced from Cloud Storage instead of inlined.
+    """
+    document_images = _unique_images(document_images)
+    if settings.gcs_image_bucket:
+        return await _build_gcs_image_parts(document_images)
+
+    parts = []
+    for index, doc_image in enumerate(document_images):
+        if index:
+            # Decoding holds the GIL, so a worker thread would not run it in parallel. Yielding between
+            # images instead lets other requests run, stalling the event loop for at most one image at a time
+            await asyncio.sleep(0)
         try:
-            image_bytes = base64.b64decode(doc_image.image_base64)
+            image_bytes = _decode_image(doc_image)
             image_part = Part.from_data(data=image_bytes, mime_type=doc_image.mime_type)
             parts.append(image_part)
         except Exception as e:
@@ -117,32 +311,368 @@ def _build_gemini_parts_from_request(
             # Optionally, skip this image or raise an error
     return parts
 
-# --- Service Functions ---
-async def extract_identifiers_from_gemini(
-    request_data: schemas.IdentifierExtractionRequest
-) -> schemas.IdentifierExtractionResponse:
+# Images are stored content-addressed under this prefix, so a digest always maps to the same blob
+_GCS_IMAGE_PREFIX = "document-images/"
+# Digests known to be in the bucket already, oldest first; bounded so the process does not grow without limit
+_UPLOADED_IMAGE_DIGESTS: "OrderedDict[str, None]" = OrderedDict()
+_MAX_UPLOADED_IMAGE_DIGESTS = 4096
+
+@functools.lru_cache(maxsize=1)
+def _get_image_bucket() -> storage.Bucket:
+    """Returns the Cloud Storage bucket used for document images, using the credentials Vertex AI was initialized with."""
+    client = storage.Client(project=settings.gcp_project_id, credentials=_credentials)
+    return client.bucket(settings.gcs_image_bucket)
+
+def _upload_image(digest: str, image_bytes: bytes, mime_type: str) -> None:
+    """Uploads an image under its digest unless a blob with that name already exists. Blocking."""
+    blob = _get_image_bucket().blob(_GCS_IMAGE_PREFIX + digest)
+    try:
+        blob.upload_from_string(image_bytes, content_type=mime_type, if_generation_match=0)
+    except PreconditionFailed:
+        # Uploaded earlier, possibly by another process; the content is identical by construction
+        pass
+
+async def _store_image_in_gcs(image_bytes: bytes, mime_type: str) -> str:
     """
-    Extracts identifiers from documents using Gemini.
+    Makes sure the image is in the Cloud Storage bucket under the SHA-256 of its bytes and returns its gs:// URI.
+    Each distinct image is uploaded once; resubmissions reuse the existing blob.
     """
-    if not _vertex_ai_initialized:
-        logger.error("Vertex AI not initialized. Cannot process request.")
-        return schemas.IdentifierExtractionResponse(extracted_identifiers={}, error_message="Vertex AI client not initialized.")
+    digest = hashlib.sha256(image_bytes).hexdigest()
 
-    # List of model names to try in order of preference
-    model_names = [
-        settings.gemini_model_name,      # Try the configured model first (gemini-2.0-flash-001)
-        "gemini-2.0-flash-lite-001",     # Gemini 2.0 Flash Lite model as fallback
-    ]
+    if digest in _UPLOADED_IMAGE_DIGESTS:
+        _UPLOADED_IMAGE_DIGESTS.move_to_end(digest)
+    else:
+        await asyncio.to_thread(_upload_image, digest, image_bytes, mime_type)
+        _UPLOADED_IMAGE_DIGESTS[digest] = None
+        if len(_UPLOADED_IMAGE_DIGESTS) > _MAX_UPLOADED_IMAGE_DIGESTS:
+            _UPLOADED_IMAGE_DIGESTS.popitem(last=False)
 
-    # Fields to extract based on document type
-    fields_to_extract_map = {
-        "salesquote": ["salesQuoteNo", "customerName"],
-        "proformainvoice": ["proformaInvoiceNo"],
-        "jobconsumption": ["jobConsumptionNo"] # Example
-    }
-    expected_fields = fields_to_extract_map.get(request_data.document_type.lower(), ["documentId"])
+    return f"gs://{settings.gcs_image_bucket}/{_GCS_IMAGE_PREFIX}{digest}"
 
-    # Prepare the prompt
+async def _get_image_part_via_gcs(doc_image: schemas.DocumentImage) -> Part:
+    """
+    Returns a Part that references the image in Cloud Storage. If the upload fails, the image is sent inline instead.
+    """
+    image_bytes = _decode_image(doc_image)
+    try:
+        image_uri = await _store_image_in_gcs(image_bytes, doc_image.mime_type)
+    except Exception as e:
+        logger.warning(f"Failed to upload image to Cloud Storage, sending it inline: {e}")
+        return Part.from_data(data=image_bytes, mime_type=doc_image.mime_type)
+    return Part.from_uri(image_uri, mime_type=doc_image.mime_type)
+
+async def _build_gcs_image_parts(document_images: List[schemas.DocumentImage]) -> List[Part]:
+    """Builds Cloud Storage backed image Parts, uploading new images concurrently and skipping undecodable ones."""
+    results = await asyncio.gather(
+        *(_get_image_part_via_gcs(doc_image) for doc_image in document_images),
+        return_exceptions=True
+    )
+    parts = []
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to decode base64 image or create Part: {result}")
+        else:
+            parts.append(result)
+    return parts
+
+# Accepted spellings of each document type in a model's documentType field, keyed in lowercase
+_DOC_TYPE_ALIASES = {
+    **dict.fromkeys(("salesquote", "sales quote", "sq"), "SalesQuote"),
+    **dict.fromkeys(("proformainvoice", "proforma invoice", "proforma", "pi"), "ProformaInvoice"),
+    **dict.fromkeys(("jobconsumption", "job consumption", "job shipment", "jobshipment", "jc"), "JobConsumption"),
+}
+
+# Recognises any spelled-out alias in a free-text model response in one scan, longest alias first.
+# Two-letter abbreviations are only trusted in the documentType field, not in free text.
+_DOC_TYPE_NAME_RE = re.compile("|".join(
+    re.escape(alias) for alias in sorted(_DOC_TYPE_ALIASES, key=len, reverse=True) if len(alias) > 2
+))
+
+def _sniff_document_type(text: str) -> Optional[str]:
+    """
+    Returns the document type of the first alias found in a free-text model response, or None.
+    The response is case-folded once and searched with a single precompiled alternation.
+    """
+    match = _DOC_TYPE_NAME_RE.search(text.casefold())
+    return _DOC_TYPE_ALIASES[match.group()] if match else None
+
+def _normalize_doc_type(document_type: str) -> str:
+    """
+    Maps a document type name given by a model to SalesQuote, ProformaInvoice, JobConsumption or UNKNOWN.
+    Exact aliases are a single dict lookup; longer names are searched for a spelled-out alias.
+    """
+    return _DOC_TYPE_ALIASES.get(document_type.strip().lower()) or _sniff_document_type(document_type) or "UNKNOWN"
+
+# Field name reported for an identifier, by the first keyword found in its label
+_IDENTIFIER_LABEL_FIELD_NAMES = (
+    ("quote", "Quote No"),
+    ("invoice", "Invoice No"),
+    ("tax", "Invoice No"),
+    ("shipment", "Job Shipment No"),
+    ("job", "Job Shipment No"),
+)
+
+def _identifier_field_name(identifier_label: str) -> str:
+    """Returns the field name for an identifier label such as 'Sales Quote Number', lower-casing it once."""
+    label = identifier_label.lower()
+    for keyword, field_name in _IDENTIFIER_LABEL_FIELD_NAMES:
+        if keyword in label:
+            return field_name
+    return "Unknown"
+
+# Structural characters visited by _extract_json_object; everything else is skipped in C
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
+
+def _extract_json_object(text: str) -> Optional[str]:
+    """
+    Returns the first balanced {...} block in a model response, or None if there is none.
+    Braces inside JSON strings are ignored. This is a single forward pass over the structural
+    characters, unlike a greedy regex that backtracks from the end of the response.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped_pos = -1
+    for match in _JSON_STRUCTURE_RE.finditer(text, start):
+        pos = match.start()
+        if pos == escaped_pos:
+            continue
+        char = match.group()
+        if in_string:
+            if char == "\\":
+                escaped_pos = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:pos + 1]
+    return None
+
+def _load_json_object(text: str) -> Optional[Any]:
+    """
+    Parses a model response as JSON, or else the first balanced {...} block in it.
+    Returns None if the response contains no such block, and raises orjson.JSONDecodeError
+    if it has one that does not parse, so callers can choose their lenient fallback for each case.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        json_block = _extract_json_object(text)
+        if not json_block:
+            return None
+        return orjson.loads(json_block)
+
+class _JsonObjectTracker:
+    """
+    Follows a streamed model response chunk by chunk and reports when the first top-level
+    {...} object is complete, using the same string- and escape-aware rules as _extract_json_object.
+    Each chunk is scanned once, so the cost is linear in the response length.
+    """
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape_next = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consumes the next chunk and returns True once the first top-level object has closed."""
+        start = 0
+        if not self.started:
+            start = chunk.find("{")
+            if start < 0:
+                return False
+            self.started = True
+
+        skip_pos = 0 if self.escape_next else -1
+        self.escape_next = False
+        for match in _JSON_STRUCTURE_RE.finditer(chunk, start):
+            pos = match.start()
+            if pos == skip_pos:
+                continue
+            char = match.group()
+            if self.in_string:
+                if char == "\\":
+                    if pos + 1 == len(chunk):
+                        self.escape_next = True
+                    skip_pos = pos + 1
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+# Caps the Gemini calls in flight across all requests; callers beyond the limit queue here instead
+# of opening more connections and running into Vertex AI quota errors
+_GEMINI_SEMAPHORE = asyncio.Semaphore(settings.gemini_max_concurrency)
+
+def _as_user_contents(gemini_parts: List[Part]) -> List[Content]:
+    """
+    Wraps a request's parts in a single user turn. Given a plain list of parts, the SDK builds a new
+    Content proto on every call, copying every image into it; converting once per request lets
+    retries and hedged attempts send the same proto.
+    """
+    return [Content(role="user", parts=gemini_parts)]
+
+async def _generate_content(
+    model: GenerativeModel,
+    gemini_contents: List[Content],
+    generation_config: GenerationConfig
+):
+    """Calls generate_content_async once a concurrency slot is free."""
+    async with _GEMINI_SEMAPHORE:
+        return await model.generate_content_async(gemini_contents, generation_config=generation_config)
+
+async def _generate_json_text(
+    model: GenerativeModel,
+    gemini_contents: List[Content],
+    generation_config: GenerationConfig
+) -> str:
+    """
+    Streams a Gemini response and returns its text, stopping as soon as the first top-level
+    JSON object is complete. Anything the model would add after the object (closing code
+    fences, trailing commentary) is never waited for; responses without an object are read in full.
+    """
+    tracker = _JsonObjectTracker()
+    chunks = []
+    async with _GEMINI_SEMAPHORE:
+        stream = await model.generate_content_async(gemini_contents, generation_config=generation_config, stream=True)
+        try:
+            async for chunk in stream:
+                chunk_text = chunk.text
+                chunks.append(chunk_text)
+                if tracker.feed(chunk_text):
+                    break
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    return "".join(chunks)
+
+# Models that recently hit rate limits or server errors, by name: consecutive such failures and the
+# monotonic time until which the model is tried only after the healthy ones
+_MODEL_STATS: Dict[str, Dict[str, float]] = {}
+_MODEL_COOLDOWN_BASE_SECONDS = 5.0
+_MODEL_COOLDOWN_MAX_SECONDS = 120.0
+# Errors that say the model is overloaded or unavailable, as opposed to a bad answer for this request
+_MODEL_HEALTH_ERRORS = (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted, api_exceptions.ServerError)
+
+def _order_models_by_health(model_names: Tuple[str, ...]) -> List[str]:
+    """
+    Returns model_names with models that are cooling down moved to the end, soonest available first.
+    Cooling models are still tried as a last resort, so a request never runs out of models to try.
+    """
+    now = time.monotonic()
+    healthy = [name for name in model_names if _MODEL_STATS.get(name, {}).get("cooldown_until", 0.0) <= now]
+    if len(healthy) == len(model_names):
+        return list(model_names)
+    cooling = sorted((name for name in model_names if name not in healthy), key=lambda name: _MODEL_STATS[name]["cooldown_until"])
+    return healthy + cooling
+
+def _record_model_success(model_name: str) -> None:
+    """Clears any cooldown for a model that just answered."""
+    _MODEL_STATS.pop(model_name, None)
+
+def _record_model_failure(model_name: str, error: BaseException) -> None:
+    """Puts a model into an exponentially growing cooldown after a rate-limit or server error."""
+    if not isinstance(error, _MODEL_HEALTH_ERRORS):
+        return
+    stats = _MODEL_STATS.setdefault(model_name, {"consecutive_failures": 0, "cooldown_until": 0.0})
+    stats["consecutive_failures"] += 1
+    cooldown = min(_MODEL_COOLDOWN_BASE_SECONDS * 2 ** (stats["consecutive_failures"] - 1), _MODEL_COOLDOWN_MAX_SECONDS)
+    stats["cooldown_until"] = time.monotonic() + cooldown
+    logger.warning(f"Model {model_name} is cooling down for {cooldown:.0f}s after: {error}")
+
+async def _run_with_model_fallback(
+    model_names: Tuple[str, ...],
+    attempt: Callable[[str], Awaitable[T]],
+    purpose: str
+) -> T:
+    """
+    Runs attempt(model_name) for each model in order of preference, with models cooling down after
+    rate limiting or server errors moved to the back, and returns the first successful result.
+    The next model starts as soon as the previous one fails, or alongside it once
+    settings.gemini_hedge_delay_seconds pass without an answer (a hedged request); with a delay of
+    zero every model is started at once and the first success wins. Attempts still running when
+    one succeeds are cancelled. If every model fails, the last error is raised.
+    """
+    remaining_models = _order_models_by_health(model_names)
+    remaining_models.reverse()
+    hedge_delay = settings.gemini_hedge_delay_seconds
+    running = set()
+    last_error = None
+
+    def start_next_model() -> None:
+        if remaining_models:
+            model_name = remaining_models.pop()
+            running.add(asyncio.create_task(attempt(model_name), name=model_name))
+
+    start_next_model()
+    while hedge_delay <= 0 and remaining_models:
+        start_next_model()
+    try:
+        while running:
+            # Once every model is running there is nothing left to hedge with
+            done, _ = await asyncio.wait(
+                running,
+                timeout=hedge_delay if remaining_models else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                logger.info(f"No response within {hedge_delay}s for {purpose}, starting next model")
+                start_next_model()
+                continue
+
+            for task in done:
+                running.discard(task)
+                error = task.exception()
+                if error is None:
+                    _record_model_success(task.get_name())
+                    return task.result()
+                _record_model_failure(task.get_name(), error)
+                last_error = error
+                logger.warning(f"Failed to use model {task.get_name()} for {purpose}: {error}")
+                start_next_model()
+    finally:
+        for task in running:
+            task.cancel()
+
+    raise last_error
+
+# --- Service Functions ---
+@functools.lru_cache(maxsize=32)
+def _identifier_field_pattern(field: str) -> "re.Pattern[str]":
+    """Returns the compiled lenient pattern for a `"field": "value"` or `field: value` pair in a malformed response."""
+    return re.compile(rf'["\']?{re.escape(field)}["\']?\s*:\s*["\']?(.*?)["\']?[,}}]')
+
+# Fields to extract based on document type
+_IDENTIFIER_FIELDS_BY_DOC_TYPE = {
+    "salesquote": ["salesQuoteNo", "customerName"],
+    "proformainvoice": ["proformaInvoiceNo"],
+    "jobconsumption": ["jobConsumptionNo"] # Example
+}
+
+def _build_identifier_extraction_prompt(
+    request_data: schemas.IdentifierExtractionRequest
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Build the identifier extraction prompt, returning it with the fields it asks for.
+    """
+    expected_fields = _IDENTIFIER_FIELDS_BY_DOC_TYPE.get(request_data.document_type.lower(), ["documentId"])
     prompt_structure = {
         "task_description": "Extract key identifiers from the provided document.",
         "document_type_context": request_data.document_type,
@@ -152,143 +682,317 @@ async def extract_identifiers_from_gemini(
                         "and values are the extracted strings. If a field is not found, omit it from the JSON or return null for its value.",
         "output_format_example": {field: "extracted_value" for field in expected_fields}
     }
-    prompt_text = json.dumps(prompt_structure, indent=2)
-    logger.debug(f"Gemini Identifier Extraction Prompt for job {request_data.job_no}:\n{prompt_text}")
+    return prompt_structure, expected_fields
+
+def _parse_identifier_response(raw_response: str, expected_fields: List[str]) -> Dict[str, Any]:
+    """
+    Parses the identifiers out of a model response, tolerating text around the JSON and,
+    as a last resort, malformed JSON. Raises ValueError if the response has no JSON object at all.
+    """
+    try:
+        extracted_data = _load_json_object(raw_response)
+    except orjson.JSONDecodeError:
+        # If still failing, try a more lenient approach
+        logger.warning("Could not parse JSON directly. Attempting to extract field values manually.")
+        extracted_data = {}
+        for field in expected_fields:
+            # Look for patterns like "field": "value" or field: value
+            match = _identifier_field_pattern(field).search(raw_response)
+            if match:
+                extracted_data[field] = match.group(1).strip()
+        return extracted_data
+
+    if extracted_data is None:
+        raise ValueError(f"Could not extract JSON from response: {raw_response}")
+    return extracted_data
+
+# Generation parameters for identifier extraction, with the top_p/top_k variant used for Gemini 2.0 models
+_IDENTIFIER_EXTRACTION_GENERATION_CONFIG = GenerationConfig(temperature=0.2, max_output_tokens=1024)
+_IDENTIFIER_EXTRACTION_GEMINI_2_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.2,
+    max_output_tokens=1024,
+    top_p=0.95,
+    top_k=40
+)
+
+async def extract_identifiers_from_gemini(
+    request_data: schemas.IdentifierExtractionRequest
+) -> schemas.IdentifierExtractionResponse:
+    """
+    Extracts identifiers from documents using Gemini.
+    """
+    if not _vertex_ai_initialized:
+        logger.error("Vertex AI not initialized. Cannot process request.")
+        return schemas.IdentifierExtractionResponse(extracted_identifiers={}, error_message="Vertex AI client not initialized.")
+
+
+    # Prepare the prompt
+    prompt_structure, expected_fields = _build_identifier_extraction_prompt(request_data)
+    prompt_text = orjson.dumps(prompt_structure).decode()
+    logger.debug("Gemini Identifier Extraction Prompt for job %s:\n%s", request_data.job_no, prompt_text)
 
     # Prepare the image parts
-    gemini_parts = _build_gemini_parts_from_request(prompt_text, request_data.document_images)
-    if not any(isinstance(part, Image) for part in gemini_parts if hasattr(part, '_image')): # Check if any image parts were successfully created
-         if any(isinstance(part, Part) and part.inline_data for part in gemini_parts): # Check based on inline_data for older SDK versions
-            pass # At least one image part exists
-         elif len(request_data.document_images) > 0 : # If images were provided but not processed
-            logger.warning("No image parts were successfully created for Gemini request, though images were provided.")
-            # Decide if to proceed without images or return error
-
-    # Configure generation parameters
-    generation_config = GenerationConfig(temperature=0.2, max_output_tokens=1024)
-
-    # Try each model in sequence until one works
+    gemini_parts = await _build_gemini_parts_from_request(prompt_text, request_data.document_images)
+    # The prompt is always the first part, so anything beyond it is an image
+    if len(gemini_parts) == 1 and request_data.document_images:
+        logger.warning("No image parts were successfully created for Gemini request, though images were provided.")
+        # Decide if to proceed without images or return error
+    gemini_contents = _as_user_contents(gemini_parts)
+
+    # Try each model in order of preference, hedging slow attempts
     last_error = None
-    for model_name in model_names:
-        try:
-            logger.info(f"Attempting to use model: {model_name}")
-            model = GenerativeModel(model_name)
-
-            # All models in our list are vision-capable
-            # Configure generation parameters for Gemini 2.0 models
-            if "gemini-2.0" in model_name:
-                # Gemini 2.0 models may need specific configuration
-                generation_config = GenerationConfig(
-                    temperature=0.2,
-                    max_output_tokens=1024,
-                    top_p=0.95,
-                    top_k=40
-                )
 
-            # Use the full multimodal request for all models
-            response = await model.generate_content_async(gemini_parts, generation_config=generation_config)
+    async def attempt(model_name: str) -> schemas.IdentifierExtractionResponse:
+        logger.info(f"Attempting to use model: {model_name}")
+        model = _get_model(model_name)
 
-            raw_response = response.text
-            logger.debug(f"Raw model response for identifier extraction (job {request_data.job_no}): {raw_response}")
+        # All models in our list are vision-capable
+        # Gemini 2.0 models may need specific configuration
+        if model_name.startswith("gemini-2.0"):
+            generation_config = _IDENTIFIER_EXTRACTION_GEMINI_2_GENERATION_CONFIG
+        else:
+            generation_config = _IDENTIFIER_EXTRACTION_GENERATION_CONFIG
 
-            # Try to extract JSON from the response, handling potential text wrapping
-            try:
-                # First try direct JSON parsing
-                extracted_data = json.loads(raw_response)
-            except json.JSONDecodeError:
-                # If that fails, try to extract JSON from the text
-                import re
-                json_match = re.search(r'({[\s\S]*})', raw_response)
-                if json_match:
-                    try:
-                        extracted_data = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        # If still failing, try a more lenient approach
-                        logger.warning(f"Could not parse JSON directly. Attempting to extract field values manually.")
-                        extracted_data = {}
-                        for field in expected_fields:
-                            # Look for patterns like "field": "value" or field: value
-                            pattern = rf'["\']?{field}["\']?\s*:\s*["\']?(.*?)["\']?[,}}]'
-                            match = re.search(pattern, raw_response)
-                            if match:
-                                extracted_data[field] = match.group(1).strip()
-                else:
-                    raise ValueError(f"Could not extract JSON from response: {raw_response}")
+        # Use the full multimodal request for all models
+        response = await _generate_content(model, gemini_contents, generation_config)
 
-            # If we get here, the model worked
-            logger.info(f"Successfully used model: {model_name}")
-            return schemas.IdentifierExtractionResponse(extracted_identifiers=extracted_data)
+        raw_response = response.text
+        logger.debug("Raw model response for identifier extraction (job %s): %s", request_data.job_no, raw_response)
 
-        except Exception as e:
-            last_error = e
-            logger.warning(f"Failed to use model {model_name}: {e}")
-            continue  # Try the next model
+        # Try to extract JSON from the response, handling potential text wrapping
+        extracted_data = _parse_identifier_response(raw_response, expected_fields)
 
-    # If we get here, all models failed
+        # If we get here, the model worked
+        logger.info(f"Successfully used model: {model_name}")
+        return schemas.IdentifierExtractionResponse(extracted_identifiers=extracted_data)
+
+    try:
+        return await _run_with_model_fallback(_MODEL_NAMES, attempt, "identifier extraction")
+    except Exception as e:
+        last_error = e
+
+    # If we get here, all models failed. The fields are known to be valid, so skip validation on this outage path
     error_message = f"All Gemini models failed. Last error: {str(last_error)}"
     logger.error(error_message)
-    return schemas.IdentifierExtractionResponse(extracted_identifiers={}, error_message=error_message)
+    return schemas.IdentifierExtractionResponse.model_construct(extracted_identifiers={}, error_message=error_message)
+
+# Batch prediction inputs and outputs are stored in the image bucket under this prefix, one folder per job
+_BATCH_JOB_PREFIX = "batch-jobs/"
+
+def _upload_batch_input(batch_id: str, jsonl: bytes) -> str:
+    """Uploads the JSONL input of a batch prediction job and returns its gs:// URI. Blocking."""
+    blob_name = f"{_BATCH_JOB_PREFIX}{batch_id}/input.jsonl"
+    _get_image_bucket().blob(blob_name).upload_from_string(jsonl, content_type="application/jsonl")
+    return f"gs://{settings.gcs_image_bucket}/{blob_name}"
+
+def _read_batch_jsonl(location: str) -> List[str]:
+    """Returns the lines of every JSONL file under a gs:// location, such as a batch job's input or output. Blocking."""
+    bucket_name, _, prefix = location.removeprefix("gs://").partition("/")
+    bucket = _get_image_bucket().client.bucket(bucket_name)
+    lines = []
+    for blob in bucket.list_blobs(prefix=prefix):
+        if blob.name.endswith(".jsonl"):
+            lines.extend(line for line in blob.download_as_text().splitlines() if line.strip())
+    return lines
+
+async def submit_identifier_extraction_batch(
+    requests: List[schemas.IdentifierExtractionRequest]
+) -> schemas.IdentifierExtractionBatchResponse:
+    """
+    Submits identifier extraction for several documents as one Vertex AI batch prediction job.
+    Batch jobs are billed at a discount and complete asynchronously; poll
+    collect_identifier_extraction_batch with the returned job_id for the results.
+    Images are referenced from the Cloud Storage bucket, so settings.gcs_image_bucket must be set.
+    """
+    if not _vertex_ai_initialized:
+        logger.error("Vertex AI not initialized. Cannot process request.")
+        return schemas.IdentifierExtractionBatchResponse(error_message="Vertex AI client not initialized.")
+    if not settings.gcs_image_bucket:
+        return schemas.IdentifierExtractionBatchResponse(error_message="Batch extraction requires GCS_IMAGE_BUCKET to be configured.")
 
+    try:
+        lines = []
+        for index, request_data in enumerate(requests):
+            prompt_structure, _ = _build_identifier_extraction_prompt(request_data)
+            parts = [{"text": orjson.dumps(prompt_structure).decode()}]
+            for doc_image in request_data.document_images:
+                image_uri = await _store_image_in_gcs(_decode_image(doc_image), doc_image.mime_type)
+                parts.append({"fileData": {"fileUri": image_uri, "mimeType": doc_image.mime_type}})
+            lines.append(orjson.dumps({
+                "request": {
+                    "contents": [{"role": "user", "parts": parts}],
+                    "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1024},
+                    # Batch output is not guaranteed to keep input order, so each request is labelled with its position
+                    "labels": {"request_key": str(index)}
+                }
+            }))
+
+        batch_id = uuid.uuid4().hex
+        input_uri = await asyncio.to_thread(_upload_batch_input, batch_id, b"\n".join(lines))
+        job = await asyncio.to_thread(
+            BatchPredictionJob.submit,
+            source_model=settings.gemini_model_name,
+            input_dataset=input_uri,
+            output_uri_prefix=f"gs://{settings.gcs_image_bucket}/{_BATCH_JOB_PREFIX}{batch_id}/output"
+        )
+    except Exception as e:
+        error_message = f"Failed to submit batch identifier extraction: {e}"
+        logger.error(error_message, exc_info=True)
+        return schemas.IdentifierExtractionBatchResponse(error_message=error_message)
+
+    logger.info(f"Submitted batch identifier extraction job {job.name} for {len(requests)} documents")
+    return schemas.IdentifierExtractionBatchResponse(job_id=job.name, state=job.state.name)
+
+def _parse_batch_output_line(line: str) -> Tuple[int, schemas.IdentifierExtractionResponse]:
+    """Maps one line of batch prediction output back to its request position and extraction result."""
+    entry = orjson.loads(line)
+    index = int(entry["request"]["labels"]["request_key"])
+    prompt_structure = orjson.loads(entry["request"]["contents"][0]["parts"][0]["text"])
+
+    candidates = entry.get("response", {}).get("candidates") or []
+    if not candidates:
+        error_message = f"No response from Gemini: {entry.get('status') or 'no candidates returned'}"
+        return index, schemas.IdentifierExtractionResponse(extracted_identifiers={}, error_message=error_message)
+
+    raw_response = "".join(part.get("text", "") for part in candidates[0].get("content", {}).get("parts", []))
+    expected_fields = _IDENTIFIER_FIELDS_BY_DOC_TYPE.get(prompt_structure["document_type_context"].lower(), ["documentId"])
+    try:
+        extracted_data = _parse_identifier_response(raw_response, expected_fields)
+        return index, schemas.IdentifierExtractionResponse(extracted_identifiers=extracted_data)
+    except Exception as e:
+        return index, schemas.IdentifierExtractionResponse(extracted_identifiers={}, error_message=str(e))
 
-def _create_missing_identifier_error(document_type: str, missing_identifiers: list) -> str:
+async def collect_identifier_extraction_batch(job_id: str) -> schemas.IdentifierExtractionBatchResponse:
+    """
+    Returns the state of a batch identifier extraction job and, once it has succeeded,
+    one result per submitted request in submission order.
+    """
+    if not _vertex_ai_initialized:
+        logger.error("Vertex AI not initialized. Cannot process request.")
+        return schemas.IdentifierExtractionBatchResponse(job_id=job_id, error_message="Vertex AI client not initialized.")
+
+    try:
+        job = await asyncio.to_thread(BatchPredictionJob, job_id)
+        if not job.has_ended:
+            return schemas.IdentifierExtractionBatchResponse(job_id=job_id, state=job.state.name)
+        if not job.has_succeeded:
+            return schemas.IdentifierExtractionBatchResponse(job_id=job_id, state=job.state.name, error_message=f"Batch job did not succeed: {job.error}")
+
+        input_uri = job.gca_resource.input_config.gcs_source.uris[0]
+        request_count = len(await asyncio.to_thread(_read_batch_jsonl, input_uri))
+        lines = await asyncio.to_thread(_read_batch_jsonl, job.output_location)
+        results_by_index = dict(_parse_batch_output_line(line) for line in lines)
+    except Exception as e:
+        error_message = f"Failed to collect batch identifier extraction job {job_id}: {e}"
+        logger.error(error_message, exc_info=True)
+        return schemas.IdentifierExtractionBatchResponse(job_id=job_id, error_message=error_message)
+
+    results = [
+        results_by_index.get(index) or schemas.IdentifierExtractionResponse(extracted_identifiers={}, error_message=f"No result returned for request {index}.")
+        for index in range(request_count)
+    ]
+    return schemas.IdentifierExtractionBatchResponse(job_id=job_id, state=job.state.name, results=results)
+
+
+# Per lower-cased document type: the keyword that marks an identifier as the document's number,
+# and the message reported when it is missing
+_MISSING_IDENTIFIER_MESSAGES = {
+    "salesquote": ("quote", "Cannot find Sales Quote Number from Sales Quote document"),
+    "proformainvoice": ("invoice", "Cannot find Tax Invoice Number from Proforma Invoice document - please check Proforma Invoice"),
+    "jobconsumption": ("job", "Cannot find Job Number from Job Consumption document"),
+}
+
+def _create_missing_identifier_error(document_type: str, missing_identifiers: list, doc_type_key: Optional[str] = None) -> str:
     """
     Creates user-friendly error messages for missing identifiers based on document type.
+    doc_type_key is the already lower-cased document type, when the caller has it.
     """
-    error_messages = []
-
-    for identifier in missing_identifiers:
-        if document_type.lower() == "salesquote":
-            if "sales_quote_number" in identifier.lower() or "quote" in identifier.lower():
-                error_messages.append("Cannot find Sales Quote Number from Sales Quote document")
-        elif document_type.lower() == "proformainvoice":
-            if "tax_invoice_number" in identifier.lower() or "invoice" in identifier.lower():
-                error_messages.append("Cannot find Tax Invoice Number from Proforma Invoice document - please check Proforma Invoice")
-        elif document_type.lower() == "jobconsumption":
-            if "job_number" in identifier.lower() or "job" in identifier.lower():
-                error_messages.append("Cannot find Job Number from Job Consumption document")
-        else:
-            # Generic message for unknown document types
-            error_messages.append(f"Cannot find required identifier {identifier} from {document_type} document")
+    if doc_type_key is None:
+        doc_type_key = document_type.lower()
+    known_type = _MISSING_IDENTIFIER_MESSAGES.get(doc_type_key)
+    if known_type is None:
+        # Generic message for unknown document types
+        error_messages = [f"Cannot find required identifier {identifier} from {document_type} document" for identifier in missing_identifiers]
+    else:
+        keyword, message = known_type
+        error_messages = [message for identifier in missing_identifiers if keyword in identifier.lower()]
 
     return "; ".join(error_messages) if error_messages else f"Missing required identifiers from {document_type} document"
 
 
+# Identifiers of which at least one must be extracted, per lower-cased document type
+_REQUIRED_IDENTIFIERS = {
+    "salesquote": ("sales_quote_number", "salesQuoteNo"),
+    "proformainvoice": ("tax_invoice_number", "taxInvoiceNo"),
+    "jobconsumption": ("job_number", "jobNo"),
+}
+
 def _validate_extracted_identifiers(document_type: str, extracted_identifiers: dict) -> tuple[bool, str]:
     """
     Validates that required identifiers were extracted based on document type.
     Returns (is_valid, error_message).
     """
-    required_identifiers = {
-        "salesquote": ["sales_quote_number", "salesQuoteNo"],
-        "proformainvoice": ["tax_invoice_number", "taxInvoiceNo"],
-        "jobconsumption": ["job_number", "jobNo"]
-    }
-
-    doc_type_lower = document_type.lower()
-    if doc_type_lower not in required_identifiers:
+    doc_type_key = document_type.lower()
+    required_fields = _REQUIRED_IDENTIFIERS.get(doc_type_key)
+    if required_fields is None:
         return True, ""  # Unknown document type, skip validation
 
-    required_fields = required_identifiers[doc_type_lower]
-    missing_identifiers = []
-
     # Check if any of the required identifiers are present
-    found_any = False
-    for field in required_fields:
-        if field in extracted_identifiers and extracted_identifiers[field]:
-            found_any = True
-            break
-
-    if not found_any:
-        missing_identifiers.extend(required_fields)
+    if any(extracted_identifiers.get(field) for field in required_fields):
+        return True, ""
 
-    if missing_identifiers:
-        error_message = _create_missing_identifier_error(document_type, missing_identifiers)
-        return False, error_message
-
-    return True, ""
+    error_message = _create_missing_identifier_error(document_type, list(required_fields), doc_type_key)
+    return False, error_message
 
 
 # Helper functions for building document-specific prompts
+# Static Sales Quote verification instructions, shared by every prompt instead of rebuilt per request
+_SALES_QUOTE_VERIFICATION_INSTRUCTIONS = {
+    "outputSchema": {
+        "discrepancies": [
+            {
+                "discrepancy_type": "MISSING_IN_DOCUMENT | UNEXPECTED_IN_DOCUMENT | FORMAT_ERROR | VALUE_MISMATCH_FUZZY", # VALUE_MISMATCH for fuzzy only
+                "field_name": "string (e.g., 'header.Sell_to_Customer_Name', 'lines.0.Quantity')",
+                "document_value": "string (The value as found in the document, or null)",
+                "erp_value": "string (The expected ERP value, especially for fuzzy matches, or null)",
+                "severity": "high | medium | low",
+                "description": "string (Describe why it's missing, unexpected, or details of a fuzzy mismatch. Backend generates most exact mismatches.)"
+            }
+        ],
+        "field_confidences": [
+            {
+                "field_name": "string (e.g., 'header.Sales_Quote_Number', 'lines.0.Description')",
+                "extracted_value": "any (The raw value extracted from the document)",
+                "extraction_confidence": "float (0.0-1.0, LLM's confidence in the accuracy of extracted_value)",
+                "match_assessment_confidence": "float (0.0-1.0, Optional: LLM's confidence if it performed a fuzzy match comparison against an expected value. Otherwise null.)"
+            }
+        ],
+        "overall_verification_confidence": "float (0.0-1.0, LLM's overall confidence in the extraction and any performed fuzzy matches)"
+    },
+    "headerFieldsToVerify": [
+        {"documentFieldName": "Sales Quote Number", "instruction": "Extract the Sales Quote Number (usually format 'SQXXXXXX').", "erpPath": "salesQuoteHeader.No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Sales Quote Number ('{actual}') != BC No ('{expected}')."},
+        {"documentFieldName": "Customer Account Number", "instruction": "Extract the Customer Account Number.", "erpPath": "salesQuoteHeader.Sell_to_Customer_No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Account No ('{actual}') != BC Sell_to_Customer_No ('{expected}')."},
+        {"documentFieldName": "Customer Name", "instruction": "Extract the Customer Name. If expected data is available, assess fuzzy match.", "erpPath": "salesQuoteHeader.Sell_to_Customer_Name", "comparisonType": "fuzzy_match_ignore_case_whitespace", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Customer Name ('{actual}') != BC Sell_to_Customer_Name ('{expected}')."},
+        {"documentFieldName": "Total Amount Including VAT", "instruction": "Extract the Total Amount Including VAT. Extract as a numeric string, preserving original format as much as possible (e.g. '22,200.00').", "erpPath": "salesQuoteHeader.Amount_Including_VAT", "comparisonType": "numeric_match_2_decimals", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Total Amount ('{actual}') != BC Amount_Including_VAT ('{expected}')."}
+    ],
+    "lineItemFieldsToVerify": [
+        {"documentFieldName": "Description", "instruction": "Extract the line item Description. This is key for matching. If expected data is available, assess fuzzy match.", "erpPath": "Description", "comparisonType": "fuzzy_match_ignore_case_whitespace", "isKeyForMatching": True},
+        {"documentFieldName": "Quantity", "instruction": "Extract the line item Quantity. Extract as a numeric string.", "erpPath": "Quantity", "comparisonType": "numeric_match_allow_integer_vs_decimal", "discrepancyFormat": "Sales Quote PDF vs BC Line Item '{matchedDescription}' Mismatch: Quantities differ (Document: {actual}, BC: {expected})."}
+    ],
+    "generalInstructions": [
+        "Analyze the provided document images which represent a Sales Quote.",
+        "For each field in 'headerFieldsToVerify' and 'lineItemFieldsToVerify', meticulously extract its value from the document based on the provided 'instruction'.",
+        "Return the raw extracted value for each field. For numeric fields, extract the value as seen in the document, preserving original formatting as much as possible unless instructed otherwise.",
+        "For fields with 'fuzzy_match_ignore_case_whitespace' comparisonType, if corresponding 'expectedErpData' is available, you may also provide a 'match_assessment_confidence' for your comparison.",
+        "If you cannot find a field, report it in 'discrepancies' as 'MISSING_IN_DOCUMENT'.",
+        "If you find clearly extra fields not specified for extraction but seem important, you may report them as 'UNEXPECTED_IN_DOCUMENT'.",
+        "Match extracted line items to ERP line items primarily using 'Description' (fuzzy match).",
+        "Report all findings in the JSON format defined in 'outputSchema'.",
+        "Provide 'extraction_confidence' for every extracted field. This reflects your certainty about the accuracy of the extracted text/value itself.",
+        "The backend service will perform most of the strict comparisons against ERP data using your extracted values."
+    ]
+}
+
 def _build_sales_quote_prompt(job_no: str, erp_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Build a structured prompt for Sales Quote verification.
@@ -308,55 +1012,58 @@ def _build_sales_quote_prompt(job_no: str, erp_data: Dict[str, Any]) -> Dict[str
             "salesQuoteHeader": sales_quote_header,
             "salesQuoteLines": sales_quote_lines
         },
-        "verificationInstructions": {
-            "outputSchema": {
-                "discrepancies": [
-                    {
-                        "discrepancy_type": "MISSING_IN_DOCUMENT | UNEXPECTED_IN_DOCUMENT | FORMAT_ERROR | VALUE_MISMATCH_FUZZY", # VALUE_MISMATCH for fuzzy only
-                        "field_name": "string (e.g., 'header.Sell_to_Customer_Name', 'lines.0.Quantity')",
-                        "expected_value": "any (especially for fuzzy matches)",
-                        "actual_value": "any",
-                        "description": "string (Describe why it's missing, unexpected, or details of a fuzzy mismatch. Backend generates most exact mismatches.)",
-                        "confidence": "float (0.0-1.0, for LLM's confidence in this discrepancy finding)"
-                    }
-                ],
-                "field_confidences": [
-                    {
-                        "field_name": "string (e.g., 'header.Sales_Quote_Number', 'lines.0.Description')",
-                        "extracted_value": "any (The raw value extracted from the document)",
-                        "extraction_confidence": "float (0.0-1.0, LLM's confidence in the accuracy of extracted_value)",
-                        "match_assessment_confidence": "float (0.0-1.0, Optional: LLM's confidence if it performed a fuzzy match comparison against an expected value. Otherwise null.)"
-                    }
-                ],
-                "overall_verification_confidence": "float (0.0-1.0, LLM's overall confidence in the extraction and any performed fuzzy matches)"
-            },
-            "headerFieldsToVerify": [
-                {"documentFieldName": "Sales Quote Number", "instruction": "Extract the Sales Quote Number (usually format 'SQXXXXXX').", "erpPath": "salesQuoteHeader.No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Sales Quote Number ('{actual}') != BC No ('{expected}')."},
-                {"documentFieldName": "Customer Account Number", "instruction": "Extract the Customer Account Number.", "erpPath": "salesQuoteHeader.Sell_to_Customer_No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Account No ('{actual}') != BC Sell_to_Customer_No ('{expected}')."},
-                {"documentFieldName": "Customer Name", "instruction": "Extract the Customer Name. If expected data is available, assess fuzzy match.", "erpPath": "salesQuoteHeader.Sell_to_Customer_Name", "comparisonType": "fuzzy_match_ignore_case_whitespace", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Customer Name ('{actual}') != BC Sell_to_Customer_Name ('{expected}')."},
-                {"documentFieldName": "Total Amount Including VAT", "instruction": "Extract the Total Amount Including VAT. Extract as a numeric string, preserving original format as much as possible (e.g. '22,200.00').", "erpPath": "salesQuoteHeader.Amount_Including_VAT", "comparisonType": "numeric_match_2_decimals", "discrepancyFormat": "Sales Quote Header vs BC Mismatch: Document Total Amount ('{actual}') != BC Amount_Including_VAT ('{expected}')."}
-            ],
-            "lineItemFieldsToVerify": [
-                {"documentFieldName": "Description", "instruction": "Extract the line item Description. This is key for matching. If expected data is available, assess fuzzy match.", "erpPath": "Description", "comparisonType": "fuzzy_match_ignore_case_whitespace", "isKeyForMatching": True},
-                {"documentFieldName": "Quantity", "instruction": "Extract the line item Quantity. Extract as a numeric string.", "erpPath": "Quantity", "comparisonType": "numeric_match_allow_integer_vs_decimal", "discrepancyFormat": "Sales Quote PDF vs BC Line Item '{matchedDescription}' Mismatch: Quantities differ (Document: {actual}, BC: {expected})."}
-            ],
-            "generalInstructions": [
-                "Analyze the provided document images which represent a Sales Quote.",
-                "For each field in 'headerFieldsToVerify' and 'lineItemFieldsToVerify', meticulously extract its value from the document based on the provided 'instruction'.",
-                "Return the raw extracted value for each field. For numeric fields, extract the value as seen in the document, preserving original formatting as much as possible unless instructed otherwise.",
-                "For fields with 'fuzzy_match_ignore_case_whitespace' comparisonType, if corresponding 'expectedErpData' is available, you may also provide a 'match_assessment_confidence' for your comparison.",
-                "If you cannot find a field, report it in 'discrepancies' as 'MISSING_IN_DOCUMENT'.",
-                "If you find clearly extra fields not specified for extraction but seem important, you may report them as 'UNEXPECTED_IN_DOCUMENT'.",
-                "Match extracted line items to ERP line items primarily using 'Description' (fuzzy match).",
-                "Report all findings in the JSON format defined in 'outputSchema'.",
-                "Provide 'extraction_confidence' for every extracted field. This reflects your certainty about the accuracy of the extracted text/value itself.",
-                "The backend service will perform most of the strict comparisons against ERP data using your extracted values."
-            ]
-        }
+        "verificationInstructions": _SALES_QUOTE_VERIFICATION_INSTRUCTIONS
     }
 
     return prompt
 
+# Static Proforma Invoice verification instructions, shared by every prompt instead of rebuilt per request
+_PROFORMA_INVOICE_VERIFICATION_INSTRUCTIONS = {
+    "outputSchema": {
+        "discrepancies": [
+             {
+                "discrepancy_type": "MISSING_IN_DOCUMENT | UNEXPECTED_IN_DOCUMENT | FORMAT_ERROR | VALUE_MISMATCH_FUZZY",
+                "field_name": "string",
+                "document_value": "string (Value found in the document, or null)",
+                "erp_value": "string (Expected ERP value for fuzzy matches, or null)",
+                "severity": "high | medium | low",
+                "description": "string (Describe missing/unexpected fields or fuzzy mismatch details. Backend handles most exact mismatches.)"
+            }
+        ],
+        "field_confidences": [
+            {
+                "field_name": "string",
+                "extracted_value": "any (Raw extracted value)",
+                "extraction_confidence": "float (0.0-1.0, LLM's confidence in extracted_value accuracy)",
+                "match_assessment_confidence": "float (0.0-1.0, Optional: LLM's confidence for fuzzy match comparison. Null otherwise.)"
+            }
+        ],
+        "overall_verification_confidence": "float (0.0-1.0, LLM's overall confidence in extraction and any fuzzy matches)"
+    },
+    "headerFieldsToVerify": [
+        {"documentFieldName": "Proforma Invoice Number", "instruction": "Extract the Proforma Invoice Number.", "erpPath": "salesInvoiceHeader.No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Proforma Invoice Header vs BC Mismatch: Document Proforma Invoice Number ('{actual}') != BC No ('{expected}')."},
+        {"documentFieldName": "Customer Account Number", "instruction": "Extract the Customer Account Number.", "erpPath": "salesInvoiceHeader.Sell_to_Customer_No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Proforma Invoice Header vs BC Mismatch: Document Account No ('{actual}') != BC Sell_to_Customer_No ('{expected}')."},
+        {"documentFieldName": "Customer Name", "instruction": "Extract the Customer Name. If expected data is available, assess fuzzy match.", "erpPath": "salesInvoiceHeader.Sell_to_Customer_Name", "comparisonType": "fuzzy_match_ignore_case_whitespace", "discrepancyFormat": "Proforma Invoice Header vs BC Mismatch: Document Customer Name ('{actual}') != BC Sell_to_Customer_Name ('{expected}')."}
+        # Add other header fields like Total Amount if applicable for Proforma, focusing on extraction.
+    ],
+    "lineItemFieldsToVerify": [
+        {"documentFieldName": "Description", "instruction": "Extract the line item Description. Key for matching. If expected data is available, assess fuzzy match.", "erpPath": "Description", "comparisonType": "fuzzy_match_ignore_case_whitespace", "isKeyForMatching": True},
+        {"documentFieldName": "Quantity", "instruction": "Extract the line item Quantity as a numeric string.", "erpPath": "Quantity", "comparisonType": "numeric_match_allow_integer_vs_decimal", "discrepancyFormat": "Proforma Invoice PDF vs BC Line Item '{matchedDescription}' Mismatch: Quantities differ (Document: {actual}, BC: {expected})."}
+        # Add other line item fields like Unit Price, Total Price if applicable, focusing on extraction.
+    ],
+    "generalInstructions": [
+        "Analyze the provided document images which represent a Proforma Invoice.",
+        "For each field in 'headerFieldsToVerify' and 'lineItemFieldsToVerify', meticulously extract its value from the document based on the 'instruction'.",
+        "Return the raw extracted value. For numeric fields, extract as seen, preserving format.",
+        "For fields with 'fuzzy_match_ignore_case_whitespace', if 'expectedErpData' is available, provide 'match_assessment_confidence'.",
+        "Report 'MISSING_IN_DOCUMENT' or 'UNEXPECTED_IN_DOCUMENT' discrepancies as appropriate.",
+        "Match line items using 'Description' (fuzzy match).",
+        "Report all findings in the JSON format defined in 'outputSchema'.",
+        "Provide 'extraction_confidence' for every extracted field.",
+        "The backend service will perform most strict comparisons."
+    ]
+}
+
 def _build_proforma_invoice_prompt(job_no: str, erp_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Build a structured prompt for Proforma Invoice verification.
@@ -376,55 +1083,60 @@ def _build_proforma_invoice_prompt(job_no: str, erp_data: Dict[str, Any]) -> Dic
             "salesInvoiceHeader": sales_invoice_header,
             "salesInvoiceLines": sales_invoice_lines
         },
-        "verificationInstructions": {
-            "outputSchema": {
-                "discrepancies": [
-                     {
-                        "discrepancy_type": "MISSING_IN_DOCUMENT | UNEXPECTED_IN_DOCUMENT | FORMAT_ERROR | VALUE_MISMATCH_FUZZY",
-                        "field_name": "string",
-                        "expected_value": "any (for fuzzy matches)",
-                        "actual_value": "any",
-                        "description": "string (Describe missing/unexpected fields or fuzzy mismatch details. Backend handles most exact mismatches.)",
-                        "confidence": "float (0.0-1.0, for LLM's confidence in this discrepancy finding)"
-                    }
-                ],
-                "field_confidences": [
-                    {
-                        "field_name": "string",
-                        "extracted_value": "any (Raw extracted value)",
-                        "extraction_confidence": "float (0.0-1.0, LLM's confidence in extracted_value accuracy)",
-                        "match_assessment_confidence": "float (0.0-1.0, Optional: LLM's confidence for fuzzy match comparison. Null otherwise.)"
-                    }
-                ],
-                "overall_verification_confidence": "float (0.0-1.0, LLM's overall confidence in extraction and any fuzzy matches)"
-            },
-            "headerFieldsToVerify": [
-                {"documentFieldName": "Proforma Invoice Number", "instruction": "Extract the Proforma Invoice Number.", "erpPath": "salesInvoiceHeader.No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Proforma Invoice Header vs BC Mismatch: Document Proforma Invoice Number ('{actual}') != BC No ('{expected}')."},
-                {"documentFieldName": "Customer Account Number", "instruction": "Extract the Customer Account Number.", "erpPath": "salesInvoiceHeader.Sell_to_Customer_No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Proforma Invoice Header vs BC Mismatch: Document Account No ('{actual}') != BC Sell_to_Customer_No ('{expected}')."},
-                {"documentFieldName": "Customer Name", "instruction": "Extract the Customer Name. If expected data is available, assess fuzzy match.", "erpPath": "salesInvoiceHeader.Sell_to_Customer_Name", "comparisonType": "fuzzy_match_ignore_case_whitespace", "discrepancyFormat": "Proforma Invoice Header vs BC Mismatch: Document Customer Name ('{actual}') != BC Sell_to_Customer_Name ('{expected}')."}
-                # Add other header fields like Total Amount if applicable for Proforma, focusing on extraction.
-            ],
-            "lineItemFieldsToVerify": [
-                {"documentFieldName": "Description", "instruction": "Extract the line item Description. Key for matching. If expected data is available, assess fuzzy match.", "erpPath": "Description", "comparisonType": "fuzzy_match_ignore_case_whitespace", "isKeyForMatching": True},
-                {"documentFieldName": "Quantity", "instruction": "Extract the line item Quantity as a numeric string.", "erpPath": "Quantity", "comparisonType": "numeric_match_allow_integer_vs_decimal", "discrepancyFormat": "Proforma Invoice PDF vs BC Line Item '{matchedDescription}' Mismatch: Quantities differ (Document: {actual}, BC: {expected})."}
-                # Add other line item fields like Unit Price, Total Price if applicable, focusing on extraction.
-            ],
-            "generalInstructions": [
-                "Analyze the provided document images which represent a Proforma Invoice.",
-                "For each field in 'headerFieldsToVerify' and 'lineItemFieldsToVerify', meticulously extract its value from the document based on the 'instruction'.",
-                "Return the raw extracted value. For numeric fields, extract as seen, preserving format.",
-                "For fields with 'fuzzy_match_ignore_case_whitespace', if 'expectedErpData' is available, provide 'match_assessment_confidence'.",
-                "Report 'MISSING_IN_DOCUMENT' or 'UNEXPECTED_IN_DOCUMENT' discrepancies as appropriate.",
-                "Match line items using 'Description' (fuzzy match).",
-                "Report all findings in the JSON format defined in 'outputSchema'.",
-                "Provide 'extraction_confidence' for every extracted field.",
-                "The backend service will perform most strict comparisons."
-            ]
-        }
+        "verificationInstructions": _PROFORMA_INVOICE_VERIFICATION_INSTRUCTIONS
     }
 
     return prompt
 
+# Static Job Consumption verification instructions, shared by every prompt instead of rebuilt per request
+_JOB_CONSUMPTION_VERIFICATION_INSTRUCTIONS = {
+    "outputSchema": {
+        "discrepancies": [
+            {
+                "discrepancy_type": "MISSING_IN_DOCUMENT | UNEXPECTED_IN_DOCUMENT | FORMAT_ERROR | VALUE_MISMATCH_FUZZY",
+                "field_name": "string",
+                "document_value": "string (Value found in the document, or null)",
+                "erp_value": "string (Expected ERP value for fuzzy matches, or null)",
+                "severity": "high | medium | low",
+                "description": "string (Describe missing/unexpected fields or fuzzy mismatch details. Backend handles most exact mismatches.)"
+            }
+        ],
+        "field_confidences": [
+            {
+                "field_name": "string (e.g. 'header.Job_Number', 'line.0.Description', 'additional.ReceivedBy_SignaturePresence')",
+                "extracted_value": "any (Raw extracted value, or finding like 'Signature found')",
+                "extraction_confidence": "float (0.0-1.0, LLM's confidence in extracted_value/finding accuracy)",
+                "match_assessment_confidence": "float (0.0-1.0, Optional: LLM's confidence for fuzzy match comparison. Null otherwise.)"
+            }
+        ],
+        "overall_verification_confidence": "float (0.0-1.0, LLM's overall confidence in extraction and any fuzzy matches/semantic checks)"
+    },
+    "headerFieldsToVerify": [
+        {"documentFieldName": "Job Number", "instruction": "Extract the Job Number from the document.", "erpPath": "requestContext.jobId", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Job Consumption Header vs BC Mismatch: Document Job Number ('{actual}') != Expected Job No ('{expected}')."}
+    ],
+    "lineItemFieldsToVerify": [
+        {"documentFieldName": "Description", "instruction": "Extract the line item Description. Key for matching. If expected data is available, assess fuzzy match.", "erpPath": "Description", "comparisonType": "fuzzy_match_ignore_case_whitespace", "isKeyForMatching": True},
+        {"documentFieldName": "Quantity", "instruction": "Extract the line item Quantity as a numeric string.", "erpPath": "Quantity", "comparisonType": "numeric_match_allow_integer_vs_decimal", "discrepancyFormat": "Job Consumption PDF vs BC Line Item '{matchedDescription}' Mismatch: Quantities differ (Document: {actual}, BC: {expected})."},
+        {"documentFieldName": "Item/Resource No", "instruction": "Extract the Item or Resource Number for the line item, if present.", "erpPath": "No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Job Consumption PDF vs BC Line Item '{matchedDescription}' Mismatch: Item/Resource No differs (Document: {actual}, BC: {expected}).", "optionalInDocument": True},
+        {"documentFieldName": "Type", "instruction": "Extract the Type for the line item (e.g., Item, Resource), if present.", "erpPath": "Type", "comparisonType": "exact_match_ignore_case", "discrepancyFormat": "Job Consumption PDF vs BC Line Item '{matchedDescription}' Mismatch: Type differs (Document: {actual}, BC: {expected}).", "optionalInDocument": True}
+    ],
+    "additionalVerifications": [
+        {"fieldName": "ReceivedBy_SignaturePresence", "instruction": "Check if the 'Received By' section contains a signature OR a printed name. Report your finding as 'Signature found', 'Printed name found: [name]', 'Signature and printed name found: [name]', or 'Signature/Name not found'.", "discrepancyFormat": "Job Consumption PDF Missing Signature/Name: The 'Received By' section does not appear to be signed or contain a printed name."}
+    ],
+    "generalInstructions": [
+        "Analyze the provided document images which represent a Job Consumption document.",
+        "For each field in 'headerFieldsToVerify' and 'lineItemFieldsToVerify', meticulously extract its value from the document based on the 'instruction'.",
+        "For the check in 'additionalVerifications', report your finding and confidence in 'field_confidences' using the specified 'fieldName'.",
+        "Return raw extracted values. For numeric fields, extract as seen, preserving format.",
+        "For fields with 'fuzzy_match_ignore_case_whitespace', if 'expectedErpData' is available, provide 'match_assessment_confidence'.",
+        "Report 'MISSING_IN_DOCUMENT' or 'UNEXPECTED_IN_DOCUMENT' discrepancies as appropriate.",
+        "Match line items using 'Description' (fuzzy match).",
+        "Report all findings in the JSON format defined in 'outputSchema'.",
+        "Provide 'extraction_confidence' for every extracted field and performed check.",
+        "The backend service will perform most strict comparisons."
+    ]
+}
+
 def _build_job_consumption_prompt(job_no: str, erp_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Build a structured prompt for Job Consumption verification.
@@ -442,118 +1154,217 @@ def _build_job_consumption_prompt(job_no: str, erp_data: Dict[str, Any]) -> Dict
         "expectedErpData": {
             "jobLedgerEntries": job_ledger_entries
         },
-        "verificationInstructions": {
-            "outputSchema": {
-                "discrepancies": [
-                    {
-                        "discrepancy_type": "MISSING_IN_DOCUMENT | UNEXPECTED_IN_DOCUMENT | FORMAT_ERROR | VALUE_MISMATCH_FUZZY",
-                        "field_name": "string",
-                        "expected_value": "any (for fuzzy matches)",
-                        "actual_value": "any",
-                        "description": "string (Describe missing/unexpected fields or fuzzy mismatch details. Backend handles most exact mismatches.)",
-                        "confidence": "float (0.0-1.0, for LLM's confidence in this discrepancy finding)"
-                    }
-                ],
-                "field_confidences": [
-                    {
-                        "field_name": "string (e.g. 'header.Job_Number', 'line.0.Description', 'additional.ReceivedBy_SignaturePresence')",
-                        "extracted_value": "any (Raw extracted value, or finding like 'Signature found')",
-                        "extraction_confidence": "float (0.0-1.0, LLM's confidence in extracted_value/finding accuracy)",
-                        "match_assessment_confidence": "float (0.0-1.0, Optional: LLM's confidence for fuzzy match comparison. Null otherwise.)"
-                    }
-                ],
-                "overall_verification_confidence": "float (0.0-1.0, LLM's overall confidence in extraction and any fuzzy matches/semantic checks)"
-            },
-            "headerFieldsToVerify": [
-                {"documentFieldName": "Job Number", "instruction": "Extract the Job Number from the document.", "erpPath": "requestContext.jobId", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Job Consumption Header vs BC Mismatch: Document Job Number ('{actual}') != Expected Job No ('{expected}')."}
-            ],
-            "lineItemFieldsToVerify": [
-                {"documentFieldName": "Description", "instruction": "Extract the line item Description. Key for matching. If expected data is available, assess fuzzy match.", "erpPath": "Description", "comparisonType": "fuzzy_match_ignore_case_whitespace", "isKeyForMatching": True},
-                {"documentFieldName": "Quantity", "instruction": "Extract the line item Quantity as a numeric string.", "erpPath": "Quantity", "comparisonType": "numeric_match_allow_integer_vs_decimal", "discrepancyFormat": "Job Consumption PDF vs BC Line Item '{matchedDescription}' Mismatch: Quantities differ (Document: {actual}, BC: {expected})."},
-                {"documentFieldName": "Item/Resource No", "instruction": "Extract the Item or Resource Number for the line item, if present.", "erpPath": "No", "comparisonType": "exact_match_alphanumeric_only", "discrepancyFormat": "Job Consumption PDF vs BC Line Item '{matchedDescription}' Mismatch: Item/Resource No differs (Document: {actual}, BC: {expected}).", "optionalInDocument": True},
-                {"documentFieldName": "Type", "instruction": "Extract the Type for the line item (e.g., Item, Resource), if present.", "erpPath": "Type", "comparisonType": "exact_match_ignore_case", "discrepancyFormat": "Job Consumption PDF vs BC Line Item '{matchedDescription}' Mismatch: Type differs (Document: {actual}, BC: {expected}).", "optionalInDocument": True}
-            ],
-            "additionalVerifications": [
-                {"fieldName": "ReceivedBy_SignaturePresence", "instruction": "Check if the 'Received By' section contains a signature OR a printed name. Report your finding as 'Signature found', 'Printed name found: [name]', 'Signature and printed name found: [name]', or 'Signature/Name not found'.", "discrepancyFormat": "Job Consumption PDF Missing Signature/Name: The 'Received By' section does not appear to be signed or contain a printed name."}
-            ],
-            "generalInstructions": [
-                "Analyze the provided document images which represent a Job Consumption document.",
-                "For each field in 'headerFieldsToVerify' and 'lineItemFieldsToVerify', meticulously extract its value from the document based on the 'instruction'.",
-                "For the check in 'additionalVerifications', report your finding and confidence in 'field_confidences' using the specified 'fieldName'.",
-                "Return raw extracted values. For numeric fields, extract as seen, preserving format.",
-                "For fields with 'fuzzy_match_ignore_case_whitespace', if 'expectedErpData' is available, provide 'match_assessment_confidence'.",
-                "Report 'MISSING_IN_DOCUMENT' or 'UNEXPECTED_IN_DOCUMENT' discrepancies as appropriate.",
-                "Match line items using 'Description' (fuzzy match).",
-                "Report all findings in the JSON format defined in 'outputSchema'.",
-                "Provide 'extraction_confidence' for every extracted field and performed check.",
-                "The backend service will perform most strict comparisons."
-            ]
-        }
+        "verificationInstructions": _JOB_CONSUMPTION_VERIFICATION_INSTRUCTIONS
     }
 
     return prompt
 
+# JSON schema of VerificationResponse for the generic prompt; generating it walks the whole model graph
+_VERIFICATION_OUTPUT_JSON_SCHEMA = schemas.VerificationResponse.model_json_schema()
+
+def _build_generic_verification_prompt(request_data: schemas.VerificationRequest) -> Dict[str, Any]:
+    """
+    Build a generic verification prompt for document types without a dedicated prompt.
+    """
+    return {
+        "task_description": "Verify the provided document against the given ERP data. Identify discrepancies, assess confidence levels for extracted and verified fields, and determine an overall verification confidence.",
+        "document_type_context": request_data.document_type,
+        "job_number_context": request_data.job_no,
+        "erp_data_for_comparison": request_data.erp_data,
+        "instructions": "Carefully analyze the document image(s). Extract relevant header and line item information. "
+                        "Compare the extracted information field by field against the 'erp_data_for_comparison'. "
+                        "Report all discrepancies found, including value mismatches, fields missing in the document, or fields unexpectedly present in the document. "
+                        "For each key field, provide your confidence in its extraction and verification. "
+                        "Finally, provide an overall confidence score for the document verification.",
+        "required_output_format": "Return a single JSON object strictly adhering to the following schema. Do not add any extra text or explanations outside this JSON object.",
+        "output_json_schema_definition": _VERIFICATION_OUTPUT_JSON_SCHEMA
+    }
+
+# Verification prompt builder for each lower-cased document type
+_VERIFICATION_PROMPT_BUILDERS: Dict[str, Callable[[str, Dict[str, Any]], Dict[str, Any]]] = {
+    "salesquote": _build_sales_quote_prompt,
+    "proformainvoice": _build_proforma_invoice_prompt,
+    "jobconsumption": _build_job_consumption_prompt,
+}
+
+def _build_verification_prompt(request_data: schemas.VerificationRequest) -> Dict[str, Any]:
+    """
+    Build the verification prompt for a document, using the document-specific prompt builder or the
+    generic prompt for unknown types.
+    """
+    document_type = request_data.document_type.lower()
+    builder = _VERIFICATION_PROMPT_BUILDERS.get(document_type)
+    if builder is not None:
+        return builder(request_data.job_no, request_data.erp_data)
+    logger.warning(f"Unknown document type: {document_type}. Using generic verification prompt.")
+    return _build_generic_verification_prompt(request_data)
+
+# Classification prompt; it does not depend on the request, so it is built once at import
+_DOC_CLASSIFICATION_PROMPT: Dict[str, Any] = {
+    "task": "document_classification",
+    "possibleDocumentTypes": [
+        {
+            "type": "SalesQuote",
+            "characteristics": [
+                "Contains 'SALES QUOTE' in the header",
+                "Has quote number, usually labeled as 'SQ' followed by numbers",
+                "Contains customer information",
+                "Has line items with descriptions, quantities, and prices",
+                "Includes payment options like 'Click here to pay via Mpesa, Click here to pay via VISA/Master Card'"
+            ]
+        },
+        {
+            "type": "ProformaInvoice",
+            "characteristics": [
+                "Contains 'PRO FORMA INVOICE' in the header",
+                "Contains phrase 'This is not a Tax Invoice. A Tax Invoice will be issued upon supply...'",
+                "Has invoice number, usually labeled as 'Tax Invoice No'",
+                "Contains customer information",
+                "Has line items with descriptions, quantities, and prices",
+                "Clearly indicates pre-sale, quotation-like purpose"
+            ]
+        },
+        {
+            "type": "JobConsumption",
+            "characteristics": [
+                "Contains 'JOB SHIPMENT' in the header",
+                "Has job shipment number field labeled as 'Job Shipment No'",
+                "Contains 'INSTRUCTED BY', 'DISPATCHED BY', 'RECEIVED BY' sections",
+                "Has logistics-related, dispatch-focused format"
+            ]
+        }
+    ],
+    "instructions": [
+        "Analyze the provided document images.",
+        "Determine which document type it matches based on the characteristics listed.",
+        "Return the document type as one of: 'SalesQuote', 'ProformaInvoice', or 'JobConsumption'.",
+        "If you cannot confidently classify the document, return 'UNKNOWN'."
+    ],
+    "outputFormat": {
+        "documentType": "The classified document type (SalesQuote, ProformaInvoice, JobConsumption, or UNKNOWN)",
+        "confidence": "A confidence score between 0.0 and 1.0",
+        "reasoning": "Brief explanation of why this classification was chosen"
+    }
+}
+
 def _build_document_classification_prompt() -> Dict[str, Any]:
     """
     Build a structured prompt for document classification.
+    Returns the shared module-level prompt; callers that add keys must copy it first.
     """
-    prompt = {
-        "task": "document_classification",
-        "possibleDocumentTypes": [
-            {
-                "type": "SalesQuote",
-                "characteristics": [
-                    "Contains 'SALES QUOTE' in the header",
-                    "Has quote number, usually labeled as 'SQ' followed by numbers",
-                    "Contains customer information",
-                    "Has line items with descriptions, quantities, and prices",
-                    "Includes payment options like 'Click here to pay via Mpesa, Click here to pay via VISA/Master Card'"
+    return _DOC_CLASSIFICATION_PROMPT
+
+# The classification prompt as sent to Gemini, serialized once at import
+_DOC_CLASSIFICATION_PROMPT_TEXT = orjson.dumps(_DOC_CLASSIFICATION_PROMPT).decode()
+
+# Static part of the classify-and-verify verification prompt. It does not depend on the request,
+# so it is serialized once and sent as the leading Part, followed by the per-request job number
+# and ERP data. Keeping this prefix byte-identical across calls lets Gemini reuse its cached
+# prefix instead of re-encoding the instructions on every request.
+_CLASSIFY_AND_VERIFY_INSTRUCTIONS = {
+    "system_context": "You are an AI document verification assistant specialized in analyzing business documents and comparing them against ERP system data.",
+    "task_description": "Verify the document against the appropriate ERP data.",
+    "document_types": {
+        "SalesQuote": {
+            "description": "A document that provides pricing for products or services before a sale is finalized.",
+            "key_identifiers": [
+                "Contains 'SALES QUOTE' in the header or title",
+                "Has a quote number or reference",
+                "Lists items with quantities and prices",
+                "May include terms and conditions",
+                "Does not indicate that payment has been made"
+            ],
+            "erp_data_mapping": {
+                "header": "salesQuoteHeader",
+                "lines": "salesQuoteLines",
+                "key_fields": [
+                    {"document_field": "Quote No", "erp_field": "No"},
+                    {"document_field": "Customer Name", "erp_field": "Sell_to_Customer_Name"},
+                    {"document_field": "Total Amount", "erp_field": "Amount_Including_VAT"}
                 ]
-            },
-            {
-                "type": "ProformaInvoice",
-                "characteristics": [
-                    "Contains 'PRO FORMA INVOICE' in the header",
-                    "Contains phrase 'This is not a Tax Invoice. A Tax Invoice will be issued upon supply...'",
-                    "Has invoice number, usually labeled as 'Tax Invoice No'",
-                    "Contains customer information",
-                    "Has line items with descriptions, quantities, and prices",
-                    "Clearly indicates pre-sale, quotation-like purpose"
+            }
+        },
+        "ProformaInvoice": {
+            "description": "A preliminary bill of sale sent to buyers before a shipment or delivery of goods.",
+            "key_identifiers": [
+                "Contains 'PRO FORMA INVOICE' in the header or title",
+                "Contains text like 'This is not a Tax Invoice'",
+                "Has an invoice number",
+                "Lists items with quantities and prices",
+                "May include payment terms"
+            ],
+            "erp_data_mapping": {
+                "header": "salesInvoiceHeader",
+                "lines": "salesInvoiceLines",
+                "key_fields": [
+                    {"document_field": "Invoice No", "erp_field": "No"},
+                    {"document_field": "Customer Name", "erp_field": "Sell_to_Customer_Name"},
+                    {"document_field": "Amount", "erp_field": "Amount"}
                 ]
-            },
-            {
-                "type": "JobConsumption",
-                "characteristics": [
-                    "Contains 'JOB SHIPMENT' in the header",
-                    "Has job shipment number field labeled as 'Job Shipment No'",
-                    "Contains 'INSTRUCTED BY', 'DISPATCHED BY', 'RECEIVED BY' sections",
-                    "Has logistics-related, dispatch-focused format"
+            }
+        },
+        "JobConsumption": {
+            "description": "A document that details materials or services used for a specific job or project.",
+            "key_identifiers": [
+                "Contains 'JOB SHIPMENT' in the header or title",
+                "Has a 'Job Shipment No' field",
+                "Lists materials or services consumed",
+                "May reference a specific job number",
+                "Often includes quantities and costs of materials used"
+            ],
+            "erp_data_mapping": {
+                "entries": "jobLedgerEntries",
+                "key_fields": [
+                    {"document_field": "Job No", "erp_field": "Job_No"},
+                    {"document_field": "Description", "erp_field": "Description"},
+                    {"document_field": "Quantity", "erp_field": "Quantity"}
                 ]
             }
+        }
+    },
+    "instructions": [
+        "STEP 1: Analyze the provided document images and confirm the document type.",
+        "Determine which document type it matches based on the characteristics listed.",
+        "Identify the document type as one of: 'SalesQuote', 'ProformaInvoice', or 'JobConsumption'.",
+        "If you cannot confidently classify the document, use 'UNKNOWN'.",
+        "",
+        "STEP 2: Verify the document against the appropriate ERP data.",
+        "Extract relevant header and line item information.",
+        "Use the erp_data_mapping to identify which fields to compare between the document and ERP data.",
+        "Compare the extracted information field by field against the appropriate section of the ERP data.",
+        "Report all discrepancies found, including value mismatches, fields missing in the document, or fields unexpectedly present in the document.",
+        "For each field you extract, provide a confidence score indicating how certain you are about the extraction.",
+        "Pay special attention to the key fields listed in the erp_data_mapping.",
+        "Finally, provide an overall verification confidence score."
+    ],
+    "output_format": {
+        "documentType": "The classified document type (SalesQuote, ProformaInvoice, JobConsumption, or UNKNOWN)",
+        "classificationConfidence": "A confidence score between 0.0 and 1.0 for the classification",
+        "classificationReasoning": "Brief explanation of why this classification was chosen",
+        "discrepancies": [
+            {
+                "field_name": "Name of the field with a discrepancy",
+                "document_value": "Value found in the document",
+                "erp_value": "Value from the ERP data",
+                "severity": "high/medium/low",
+                "description": "Optional explanation of the discrepancy"
+            }
         ],
-        "instructions": [
-            "Analyze the provided document images.",
-            "Determine which document type it matches based on the characteristics listed.",
-            "Return the document type as one of: 'SalesQuote', 'ProformaInvoice', or 'JobConsumption'.",
-            "If you cannot confidently classify the document, return 'UNKNOWN'."
+        "fieldConfidences": [
+            {
+                "field_name": "Name of the extracted field",
+                "extraction_confidence": "Confidence score between 0.0 and 1.0",
+                "extracted_value": "The value extracted from the document",
+                "verified": "Boolean indicating if the field matches the ERP data"
+            }
         ],
-        "outputFormat": {
-            "documentType": "The classified document type (SalesQuote, ProformaInvoice, JobConsumption, or UNKNOWN)",
-            "confidence": "A confidence score between 0.0 and 1.0",
-            "reasoning": "Brief explanation of why this classification was chosen"
-        }
+        "overallVerificationConfidence": "A score between 0.0 and 1.0 indicating overall confidence in the verification"
     }
-    return prompt
-
-def _build_classify_and_verify_prompt(request_data: schemas.ClassifyAndVerifyRequest) -> Dict[str, Any]:
-    """Build a combined prompt for document classification and verification."""
+}
+_CLASSIFY_AND_VERIFY_INSTRUCTIONS_TEXT = orjson.dumps(_CLASSIFY_AND_VERIFY_INSTRUCTIONS).decode()
 
-    # Check if this is the initial classification step or the verification step
-    is_initial_classification = "jobNo" in request_data.erp_data and len(request_data.erp_data) == 1
-
-    if is_initial_classification:
-        # This is the initial classification step - focus on identifying document type and extracting key identifiers
-        prompt = """
+# Prompt for the initial classification step; it does not depend on the request, so it is built once
+_INITIAL_CLASSIFICATION_PROMPT = """
 You are given one or more business documents.
 
 Your tasks are:
@@ -594,112 +1405,317 @@ Return the result in a single JSON array, with one object per document, using th
   }
 ]
 """
+
+def _build_classify_and_verify_prompt(request_data: schemas.ClassifyAndVerifyRequest) -> Dict[str, Any]:
+    """Build a combined prompt for document classification and verification."""
+
+    # Check if this is the initial classification step or the verification step
+    is_initial_classification = "jobNo" in request_data.erp_data and len(request_data.erp_data) == 1
+
+    if is_initial_classification:
+        # This is the initial classification step - focus on identifying document type and extracting key identifiers
+        prompt = _INITIAL_CLASSIFICATION_PROMPT
     else:
-        # This is the verification step - focus on verifying the document against ERP data
+        # This is the verification step - only the request-specific data is built here, the
+        # instructions are sent separately as _CLASSIFY_AND_VERIFY_INSTRUCTIONS_TEXT
         prompt = {
-            "system_context": "You are an AI document verification assistant specialized in analyzing business documents and comparing them against ERP system data.",
-            "task_description": "Verify the document against the appropriate ERP data.",
             "job_number_context": request_data.job_no,
-            "erp_data_for_comparison": request_data.erp_data,
-            "document_types": {
-                "SalesQuote": {
-                    "description": "A document that provides pricing for products or services before a sale is finalized.",
-                    "key_identifiers": [
-                        "Contains 'SALES QUOTE' in the header or title",
-                        "Has a quote number or reference",
-                        "Lists items with quantities and prices",
-                        "May include terms and conditions",
-                        "Does not indicate that payment has been made"
-                    ],
-                    "erp_data_mapping": {
-                        "header": "salesQuoteHeader",
-                        "lines": "salesQuoteLines",
-                        "key_fields": [
-                            {"document_field": "Quote No", "erp_field": "No"},
-                            {"document_field": "Customer Name", "erp_field": "Sell_to_Customer_Name"},
-                            {"document_field": "Total Amount", "erp_field": "Amount_Including_VAT"}
-                        ]
-                    }
+            "erp_data_for_comparison": request_data.erp_data
+        }
+
+    return prompt
+
+# Patterns for reading classify-and-verify responses, compiled once: a bare JSON array, and the
+# identifier labels/numbers searched for when the response is not valid JSON
+_JSON_ARRAY_RE = re.compile(r'\[\s*\{[^]]*\}\s*\]')
+_QUOTE_NUMBER_RE = re.compile(r'(?:sales\s*quote\s*number|quote\s*no|sq)[:\s]*([A-Za-z0-9]+)', re.IGNORECASE)
+_SQ_NUMBER_RE = re.compile(r'(SQ\d+)')
+_INVOICE_NUMBER_RE = re.compile(r'(?:tax\s*invoice\s*number|invoice\s*no|proforma)[:\s]*(\d+)', re.IGNORECASE)
+_LONG_NUMBER_RE = re.compile(r'(\d{6,})')
+_JOB_SHIPMENT_NUMBER_RE = re.compile(r'(?:job\s*shipment\s*no|job\s*shipment\s*number|jc)[:\s]*([A-Za-z0-9]+)', re.IGNORECASE)
+_JC_NUMBER_RE = re.compile(r'(JC\d+)')
+
+_JSON_FENCE = "```json"
+
+def _strip_json_fence(text: str) -> Optional[str]:
+    """
+    Returns the contents of the first ```json fenced block in a model response, or None if there is
+    no complete one. Plain substring searches, so bare-JSON responses cost a single find.
+    """
+    start = text.find(_JSON_FENCE)
+    if start < 0:
+        return None
+    start += len(_JSON_FENCE)
+    end = text.find("```", start)
+    if end < 0:
+        return None
+    return text[start:end].strip()
+
+# Response schemas for classify-and-verify. With a JSON response MIME type Gemini is constrained to
+# emit exactly these shapes, so the text fallbacks below are only reached on truncated output.
+_INITIAL_CLASSIFICATION_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "document_type": {"type": "string"},
+            "identifier_label": {"type": "string"},
+            "identifier_value": {"type": "string"},
+        },
+        "required": ["document_type", "identifier_label", "identifier_value"],
+    },
+}
+_CLASSIFY_AND_VERIFY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "documentType": {"type": "string", "enum": ["SalesQuote", "ProformaInvoice", "JobConsumption", "UNKNOWN"]},
+        "classificationConfidence": {"type": "number"},
+        "classificationReasoning": {"type": "string"},
+        "discrepancies": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "field_name": {"type": "string"},
+                    "document_value": {"type": "string", "nullable": True},
+                    "erp_value": {"type": "string", "nullable": True},
+                    "severity": {"type": "string", "enum": ["high", "medium", "low"]},
+                    "description": {"type": "string", "nullable": True},
                 },
-                "ProformaInvoice": {
-                    "description": "A preliminary bill of sale sent to buyers before a shipment or delivery of goods.",
-                    "key_identifiers": [
-                        "Contains 'PRO FORMA INVOICE' in the header or title",
-                        "Contains text like 'This is not a Tax Invoice'",
-                        "Has an invoice number",
-                        "Lists items with quantities and prices",
-                        "May include payment terms"
-                    ],
-                    "erp_data_mapping": {
-                        "header": "salesInvoiceHeader",
-                        "lines": "salesInvoiceLines",
-                        "key_fields": [
-                            {"document_field": "Invoice No", "erp_field": "No"},
-                            {"document_field": "Customer Name", "erp_field": "Sell_to_Customer_Name"},
-                            {"document_field": "Amount", "erp_field": "Amount"}
-                        ]
-                    }
+                "required": ["field_name", "severity"],
+            },
+        },
+        "fieldConfidences": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "field_name": {"type": "string"},
+                    "extraction_confidence": {"type": "number"},
+                    "extracted_value": {"type": "string", "nullable": True},
+                    "verified": {"type": "boolean"},
                 },
-                "JobConsumption": {
-                    "description": "A document that details materials or services used for a specific job or project.",
-                    "key_identifiers": [
-                        "Contains 'JOB SHIPMENT' in the header or title",
-                        "Has a 'Job Shipment No' field",
-                        "Lists materials or services consumed",
-                        "May reference a specific job number",
-                        "Often includes quantities and costs of materials used"
-                    ],
-                    "erp_data_mapping": {
-                        "entries": "jobLedgerEntries",
-                        "key_fields": [
-                            {"document_field": "Job No", "erp_field": "Job_No"},
-                            {"document_field": "Description", "erp_field": "Description"},
-                            {"document_field": "Quantity", "erp_field": "Quantity"}
-                        ]
-                    }
-                }
+                "required": ["field_name", "extraction_confidence"],
             },
-            "instructions": [
-                "STEP 1: Analyze the provided document images and confirm the document type.",
-                "Determine which document type it matches based on the characteristics listed.",
-                "Identify the document type as one of: 'SalesQuote', 'ProformaInvoice', or 'JobConsumption'.",
-                "If you cannot confidently classify the document, use 'UNKNOWN'.",
-                "",
-                "STEP 2: Verify the document against the appropriate ERP data.",
-                "Extract relevant header and line item information.",
-                "Use the erp_data_mapping to identify which fields to compare between the document and ERP data.",
-                "Compare the extracted information field by field against the appropriate section of the ERP data.",
-                "Report all discrepancies found, including value mismatches, fields missing in the document, or fields unexpectedly present in the document.",
-                "For each field you extract, provide a confidence score indicating how certain you are about the extraction.",
-                "Pay special attention to the key fields listed in the erp_data_mapping.",
-                "Finally, provide an overall verification confidence score."
-            ],
-            "output_format": {
-                "documentType": "The classified document type (SalesQuote, ProformaInvoice, JobConsumption, or UNKNOWN)",
-                "classificationConfidence": "A confidence score between 0.0 and 1.0 for the classification",
-                "classificationReasoning": "Brief explanation of why this classification was chosen",
-                "discrepancies": [
-                    {
-                        "field_name": "Name of the field with a discrepancy",
-                        "document_value": "Value found in the document",
-                        "erp_value": "Value from the ERP data",
-                        "severity": "high/medium/low",
-                        "description": "Optional explanation of the discrepancy"
-                    }
-                ],
-                "fieldConfidences": [
-                    {
-                        "field_name": "Name of the extracted field",
-                        "confidence": "Confidence score between 0.0 and 1.0",
-                        "extracted_value": "The value extracted from the document",
-                        "verified": "Boolean indicating if the field matches the ERP data"
-                    }
-                ],
-                "overallVerificationConfidence": "A score between 0.0 and 1.0 indicating overall confidence in the verification"
-            }
-        }
+        },
+        "overallVerificationConfidence": {"type": "number"},
+    },
+    "required": ["documentType", "classificationConfidence", "discrepancies", "fieldConfidences", "overallVerificationConfidence"],
+}
+
+# The initial-classification answer is a JSON array with one short object per document
+_INITIAL_CLASSIFICATION_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1,
+    max_output_tokens=512,
+    top_p=0.95,
+    top_k=40,
+    response_mime_type="application/json",
+    response_schema=_INITIAL_CLASSIFICATION_RESPONSE_SCHEMA
+)
+
+# Output token budget for a classify-and-verify verification: a fixed allowance for the header fields
+# and summary plus a per-line allowance for the ERP lines the model may report on, within these bounds
+_ERP_LINE_KEYS = ("salesQuoteLines", "salesInvoiceLines", "jobLedgerEntries")
+_VERIFICATION_BASE_OUTPUT_TOKENS = 512
+_VERIFICATION_OUTPUT_TOKENS_PER_LINE = 80
+_VERIFICATION_MIN_OUTPUT_TOKENS = 1024
+_VERIFICATION_MAX_OUTPUT_TOKENS = 4096
+
+def _verification_max_output_tokens(erp_data: Dict[str, Any]) -> int:
+    """Caps the verification response length by the number of ERP lines, so short documents finish sooner."""
+    line_count = sum(len(erp_data.get(key) or ()) for key in _ERP_LINE_KEYS)
+    budget = _VERIFICATION_BASE_OUTPUT_TOKENS + _VERIFICATION_OUTPUT_TOKENS_PER_LINE * line_count
+    return max(_VERIFICATION_MIN_OUTPUT_TOKENS, min(_VERIFICATION_MAX_OUTPUT_TOKENS, budget))
+
+# Initial-classification results by digest of the request's images, oldest first. The initial prompt does
+# not depend on the request, so resubmitting the same pages always asks Gemini the same question.
+_INITIAL_CLASSIFICATION_CACHE: "OrderedDict[bytes, schemas.ClassifyAndVerifyResponse]" = OrderedDict()
+_MAX_INITIAL_CLASSIFICATION_CACHE_ENTRIES = 1024
+# Classification confidence of an initial classification read from the model's JSON answer; answers pieced
+# together from a response that did not parse report less
+_PARSED_INITIAL_CLASSIFICATION_CONFIDENCE = 0.9
+
+def _document_images_digest(document_images: List[schemas.DocumentImage]) -> bytes:
+    """Digest of the images of a request, in order, hashed as received so no image has to be decoded."""
+    digest = hashlib.blake2b(digest_size=16)
+    for doc_image in document_images:
+        digest.update(doc_image.mime_type.encode())
+        digest.update(b"\0")
+        digest.update(doc_image.raw_bytes if doc_image.raw_bytes is not None else doc_image.image_base64.encode())
+        digest.update(b"\0")
+    return digest.digest()
 
-    return prompt
+async def _single_flight(in_flight: Dict[bytes, "asyncio.Future[T]"], key: bytes, compute: Callable[[], Awaitable[T]]) -> T:
+    """
+    Runs compute() once for all concurrent callers with the same key. It runs as its own task, which
+    every caller (including the one that started it) awaits through a shield, so a caller that is
+    cancelled, e.g. by a client disconnect, stops waiting without cancelling the call for the others.
+    """
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        in_flight[key] = task
+
+        def forget(done_task: "asyncio.Future[T]") -> None:
+            del in_flight[key]
+            # Mark an error as retrieved, in case every caller stopped waiting for it
+            if not done_task.cancelled():
+                done_task.exception()
+
+        task.add_done_callback(forget)
+    return await asyncio.shield(task)
+
+# Initial classification of several requests in one call: the usual prompt, plus instructions to answer per request
+_INITIAL_CLASSIFICATION_BATCH_PROMPT = _INITIAL_CLASSIFICATION_PROMPT + """
+The images belong to several separate requests. The images of each request are preceded by a marker of
+the form '--- REQUEST <index> ---', starting at index 0. Treat each request independently, and return a
+JSON array with one object per request, in request order, each with the request's index as 'requestIndex'
+and the array described above for that request's documents as 'documents'.
+"""
+_INITIAL_CLASSIFICATION_BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "requestIndex": {"type": "integer"},
+            "documents": _INITIAL_CLASSIFICATION_RESPONSE_SCHEMA,
+        },
+        "required": ["requestIndex", "documents"],
+    },
+}
+# Output tokens allowed per request in a batched initial classification, and in total
+_INITIAL_CLASSIFICATION_BATCH_TOKENS_PER_REQUEST = 512
+_INITIAL_CLASSIFICATION_BATCH_MAX_OUTPUT_TOKENS = 8192
+
+async def _classify_initial_batch(
+    requests: List[schemas.ClassifyAndVerifyRequest]
+) -> List[Optional[schemas.ClassifyAndVerifyResponse]]:
+    """
+    Runs the initial classification of several requests as a single Gemini call. Returns one response per
+    request, or None for requests the combined answer did not cover (including requests without usable images),
+    which the caller classifies on their own. Raises if every model fails.
+    """
+    gemini_parts = [_text_part(_INITIAL_CLASSIFICATION_BATCH_PROMPT)]
+    for index, request_data in enumerate(requests):
+        image_parts = await _build_image_parts(request_data.document_images)
+        if image_parts:
+            gemini_parts.append(_text_part(f"--- REQUEST {index} ---"))
+            gemini_parts.extend(image_parts)
+    gemini_contents = _as_user_contents(gemini_parts)
+
+    generation_config = GenerationConfig(
+        temperature=0.1,
+        max_output_tokens=min(_INITIAL_CLASSIFICATION_BATCH_MAX_OUTPUT_TOKENS, _INITIAL_CLASSIFICATION_BATCH_TOKENS_PER_REQUEST * len(requests)),
+        top_p=0.95,
+        top_k=40,
+        response_mime_type="application/json",
+        response_schema=_INITIAL_CLASSIFICATION_BATCH_RESPONSE_SCHEMA
+    )
+
+    async def attempt(model_name: str) -> str:
+        logger.info(f"Attempting to use model: {model_name} for initial classification of {len(requests)} requests")
+        response = await _generate_content(_get_model(model_name), gemini_contents, generation_config)
+        return response.text
+
+    raw_response_text = await _run_with_model_fallback(_MODEL_NAMES, attempt, "batched initial classification")
+
+    results_by_index = {}
+    try:
+        results = orjson.loads(raw_response_text)
+    except orjson.JSONDecodeError:
+        logger.warning(f"Could not parse batched initial classification response, classifying {len(requests)} requests individually")
+        results = []
+    for result in results if isinstance(results, list) else []:
+        if isinstance(result, dict) and isinstance(result.get("requestIndex"), int) and result.get("documents"):
+            results_by_index.setdefault(result["requestIndex"], result)
+
+    responses = []
+    for index, request_data in enumerate(requests):
+        result = results_by_index.get(index)
+        if result is None:
+            responses.append(None)
+            continue
+        # The raw response covers every request in the batch; each caller only sees its own entry
+        response_data = _build_initial_classification_response(result["documents"], orjson.dumps(result).decode())
+        extracted_identifiers = {field.field_name: field.extracted_value for field in response_data.field_confidences}
+        logger.info(f"Extracted identifiers for job {request_data.job_no} in a batch of {len(requests)}: {extracted_identifiers}")
+        responses.append(response_data)
+    return responses
+
+class _InitialClassificationBatcher:
+    """
+    Collects initial-classification requests that arrive within settings.initial_classification_batch_window_seconds
+    of each other, up to settings.initial_classification_batch_size, and classifies them with one Gemini call.
+    The fixed cost of a call is paid once per batch instead of once per request. Requests the batch could not
+    answer, and every request of a batch that failed, fall back to an individual call.
+    """
+
+    def __init__(self) -> None:
+        self.pending: List[Tuple[schemas.ClassifyAndVerifyRequest, asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        # Running batches, referenced so they are not garbage collected mid-flight
+        self.tasks: set = set()
+
+    async def submit(self, request_data: schemas.ClassifyAndVerifyRequest) -> schemas.ClassifyAndVerifyResponse:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((request_data, future))
+        if len(self.pending) >= settings.initial_classification_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(settings.initial_classification_batch_window_seconds, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: List[Tuple[schemas.ClassifyAndVerifyRequest, asyncio.Future]]) -> None:
+        requests = [request_data for request_data, _ in batch]
+        responses: List[Any] = [None] * len(batch)
+        if len(batch) > 1:
+            try:
+                responses = await _classify_initial_batch(requests)
+            except Exception as e:
+                logger.warning(f"Batched initial classification of {len(batch)} requests failed, classifying individually: {e}")
+
+        unanswered = [index for index, response in enumerate(responses) if response is None]
+        if unanswered:
+            individual = await asyncio.gather(
+                *(_classify_and_verify(requests[index]) for index in unanswered),
+                return_exceptions=True
+            )
+            for index, response in zip(unanswered, individual):
+                responses[index] = response
+
+        for (_, future), response in zip(batch, responses):
+            if future.done():
+                continue  # The caller went away
+            if isinstance(response, BaseException):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
+
+_initial_classification_batcher = _InitialClassificationBatcher()
+
+# Classification confidence at which a speculative answer is taken from the most preferred model outright
+_SPECULATIVE_CONFIDENCE_THRESHOLD = 0.85
+
+def _pick_speculative_response(responses: List[schemas.ClassifyAndVerifyResponse]) -> schemas.ClassifyAndVerifyResponse:
+    """
+    Chooses among answers from models asked concurrently, given in model preference order: the first
+    confident answer without an error, otherwise the most confident answer, preferring those without an error.
+    """
+    for response in responses:
+        if response.error_message is None and response.classification_confidence >= _SPECULATIVE_CONFIDENCE_THRESHOLD:
+            return response
+    return max(responses, key=lambda response: (response.error_message is None, response.classification_confidence))
 
 async def classify_and_verify_with_gemini(
     request_data: schemas.ClassifyAndVerifyRequest
@@ -710,7 +1726,98 @@ async def classify_and_verify_with_gemini(
     This function has been enhanced to support two modes:
     1. Initial classification mode: When erp_data only contains jobNo, it focuses on extracting document identifiers
     2. Verification mode: When erp_data contains Business Central data, it performs full verification
+
+    Initial-classification results parsed from the model's JSON and naming a document type are cached
+    by image digest; verification depends on the ERP data and is always sent to Gemini.
     """
+    is_initial_classification = "jobNo" in request_data.erp_data and len(request_data.erp_data) == 1
+    if not is_initial_classification:
+        return await _classify_and_verify(request_data)
+
+    cache_key = _document_images_digest(request_data.document_images)
+    cached_response = _lru_get(_INITIAL_CLASSIFICATION_CACHE, cache_key)
+    if cached_response is not None:
+        logger.info(f"Returning cached initial classification for job {request_data.job_no}")
+        return cached_response.model_copy(deep=True)
+
+    if settings.initial_classification_batch_window_seconds > 0:
+        response_data = await _initial_classification_batcher.submit(request_data)
+    else:
+        response_data = await _classify_and_verify(request_data)
+    # Only a parsed answer naming a document type is remembered; anything else is worth asking Gemini again
+    if (
+        response_data.error_message is None
+        and response_data.document_type != "UNKNOWN"
+        and response_data.classification_confidence >= _PARSED_INITIAL_CLASSIFICATION_CONFIDENCE
+    ):
+        _lru_put(_INITIAL_CLASSIFICATION_CACHE, cache_key, response_data.model_copy(deep=True), _MAX_INITIAL_CLASSIFICATION_CACHE_ENTRIES)
+    return response_data
+
+def _build_initial_classification_response(llm_output: Any, raw_response_text: str) -> schemas.ClassifyAndVerifyResponse:
+    """
+    Builds the initial-classification response from the model's array of identified documents
+    (document_type, identifier_label, identifier_value), one FieldConfidence per identifier found.
+    """
+    # Check if the response is an array
+    if isinstance(llm_output, list):
+        documents_array = llm_output
+    else:
+        # If it's not an array, try to wrap it in an array
+        documents_array = [llm_output]
+
+    logger.info(f"Parsed {len(documents_array)} documents from LLM response")
+
+    # Create field confidences based on all extracted identifiers
+    field_confidences = []
+    document_types = []
+    classification_reasoning = []
+
+    for doc in documents_array:
+        document_type = doc.get("document_type", "UNKNOWN")
+        identifier_label = doc.get("identifier_label", "")
+        identifier_value = doc.get("identifier_value", "")
+
+        # Map the document type to our expected format
+        normalized_type = _normalize_doc_type(document_type)
+
+        document_types.append(normalized_type)
+        classification_reasoning.append(f"{document_type} with {identifier_label}: {identifier_value}")
+
+        if identifier_value:
+            # Determine field name based on identifier label
+            field_name = _identifier_field_name(identifier_label)
+
+            field_confidences.append(
+                schemas.FieldConfidence(
+                    field_name=field_name,
+                    extraction_confidence=0.9,
+                    extracted_value=identifier_value,
+                    verified=False
+                )
+            )
+
+    # Determine the primary document type (for backward compatibility)
+    primary_document_type = "UNKNOWN"
+    if "SalesQuote" in document_types:
+        primary_document_type = "SalesQuote"
+    elif "ProformaInvoice" in document_types:
+        primary_document_type = "ProformaInvoice"
+    elif "JobConsumption" in document_types:
+        primary_document_type = "JobConsumption"
+
+    return schemas.ClassifyAndVerifyResponse(
+        document_type=primary_document_type,
+        classification_confidence=_PARSED_INITIAL_CLASSIFICATION_CONFIDENCE,
+        classification_reasoning=f"Documents identified: {', '.join(classification_reasoning)}",
+        field_confidences=field_confidences,
+        overall_verification_confidence=0.0,
+        raw_llm_response=raw_response_text
+    )
+
+async def _classify_and_verify(
+    request_data: schemas.ClassifyAndVerifyRequest
+) -> schemas.ClassifyAndVerifyResponse:
+    """Runs classify_and_verify_with_gemini against Gemini, without the result cache."""
     if not _vertex_ai_initialized:
         logger.error("Vertex AI not initialized. Cannot process request.")
         return schemas.ClassifyAndVerifyResponse(
@@ -727,25 +1834,12 @@ async def classify_and_verify_with_gemini(
     else:
         logger.info(f"Running in VERIFICATION mode for job {request_data.job_no} - performing full verification with Business Central data")
 
-    # List of model names to try in order of preference
-    model_names = [
-        settings.gemini_model_name,      # Try the configured model first (gemini-2.0-flash-001)
-        "gemini-2.0-flash-lite-001",     # Gemini 2.0 Flash Lite model as fallback
-    ]
 
     # Prepare the prompt
     prompt = _build_classify_and_verify_prompt(request_data)
 
     # Prepare the images
-    image_parts = []
-    for img_data in request_data.document_images:
-        try:
-            # Decode base64 image
-            image_bytes = base64.b64decode(img_data.image_base64)
-            image_parts.append(Part.from_data(mime_type=img_data.mime_type, data=image_bytes))
-        except Exception as e:
-            logger.error(f"Error processing image: {e}")
-            continue
+    image_parts = await _build_image_parts(request_data.document_images)
 
     if not image_parts:
         logger.error("No valid images provided for classification and verification")
@@ -759,344 +1853,363 @@ async def classify_and_verify_with_gemini(
     if is_initial_classification:
         # For initial classification, use the prompt as a string directly
         prompt_text = prompt
-        logger.info(f"Prompt for job {request_data.job_no}: {prompt_text[:200]}...")
+        logger.debug("Prompt for job %s: %.200s...", request_data.job_no, prompt_text)
+        gemini_parts = [
+            _text_part(prompt_text),
+            *image_parts
+        ]
     else:
-        # For verification, convert the prompt to a JSON string
-        prompt_text = json.dumps(prompt, indent=2)
-        logger.info(f"Prompt for job {request_data.job_no}: {prompt_text[:200]}...")
-
-    gemini_parts = [
-        Part.from_text(prompt_text),
-        *image_parts
-    ]
+        # For verification, send the static instructions first and the request data after them,
+        # serialized compactly since indentation only inflates the ERP payload
+        prompt_text = orjson.dumps(prompt).decode()
+        logger.debug("Prompt for job %s: %.200s...", request_data.job_no, prompt_text)
+        gemini_parts = [
+            _text_part(_CLASSIFY_AND_VERIFY_INSTRUCTIONS_TEXT),
+            Part.from_text(prompt_text),
+            *image_parts
+        ]
+    gemini_contents = _as_user_contents(gemini_parts)
 
     # Configure generation parameters - use different settings based on the mode
     if is_initial_classification:
         # For initial classification, we need accurate extraction of document numbers
-        generation_config = GenerationConfig(
-            temperature=0.1,
-            max_output_tokens=2048,
-            top_p=0.95,
-            top_k=40
-        )
+        generation_config = _INITIAL_CLASSIFICATION_GENERATION_CONFIG
     else:
-        # For verification, we need more detailed analysis
+        # For verification, we need more detailed analysis, sized to the number of lines to compare
         generation_config = GenerationConfig(
             temperature=0.1,
-            max_output_tokens=4096,
+            max_output_tokens=_verification_max_output_tokens(request_data.erp_data),
             top_p=0.95,
-            top_k=40
+            top_k=40,
+            response_mime_type="application/json",
+            response_schema=_CLASSIFY_AND_VERIFY_RESPONSE_SCHEMA
         )
 
     last_error = None
-    raw_response_text = ""
+    # Raw text of the latest answer, reported if no answer can be used. Each attempt parses its own text,
+    # so concurrent attempts never see each other's answers.
+    last_raw_response_text = ""
+
+    async def attempt(model_name: str) -> schemas.ClassifyAndVerifyResponse:
+        nonlocal last_raw_response_text
+        logger.info(f"Attempting to use model: {model_name} for document classification and verification")
+        model = _get_model(model_name)
+
+        # Use the full multimodal request. A verification response is a single JSON object, so its stream
+        # is cut off as soon as the object closes; the initial-classification array is short and read whole
+        if is_initial_classification:
+            response = await _generate_content(model, gemini_contents, generation_config)
+            raw_response_text = response.text
+        else:
+            raw_response_text = await _generate_json_text(model, gemini_contents, generation_config)
+        last_raw_response_text = raw_response_text
+        logger.debug("Raw model response for classification and verification (job %s): %s", request_data.job_no, raw_response_text)
 
-    for model_name in model_names:
+        # Try to parse the JSON response
         try:
-            logger.info(f"Attempting to use model: {model_name} for document classification and verification")
-            model = GenerativeModel(model_name)
-
-            # Use the full multimodal request
-            response = await model.generate_content_async(gemini_parts, generation_config=generation_config)
-            raw_response_text = response.text
-            logger.debug(f"Raw model response for classification and verification (job {request_data.job_no}): {raw_response_text}")
+            # First try to extract JSON from the response if it's not already in JSON format
+            json_str = _strip_json_fence(raw_response_text)
+            if json_str is not None:
+                llm_output_dict = orjson.loads(json_str)
+            elif is_initial_classification:
+                # Try to parse the whole response as JSON
+                llm_output_dict = orjson.loads(raw_response_text)
+            else:
+                # A streamed verification response ends with its object, before any closing code fence
+                llm_output_dict = orjson.loads(_extract_json_object(raw_response_text) or raw_response_text)
 
-            # Try to parse the JSON response
-            try:
-                # First try to extract JSON from the response if it's not already in JSON format
-                import re
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', raw_response_text)
-                if json_match:
-                    json_str = json_match.group(1)
-                    llm_output_dict = json.loads(json_str)
+            # Convert the response to our schema format
+            if is_initial_classification:
+                # Handle the new array format for initial classification
+                response_data = _build_initial_classification_response(llm_output_dict, raw_response_text)
+            else:
+                # Use the original format for verification, validated in a single pass over the whole tree
+                response_data = schemas.ClassifyAndVerifyResponse.model_validate({
+                    "document_type": llm_output_dict.get("documentType", "UNKNOWN"),
+                    "classification_confidence": llm_output_dict.get("classificationConfidence", 0.0),
+                    "classification_reasoning": llm_output_dict.get("classificationReasoning", "No reasoning provided"),
+                    "discrepancies": llm_output_dict.get("discrepancies", []),
+                    "field_confidences": llm_output_dict.get("fieldConfidences", []),
+                    "overall_verification_confidence": llm_output_dict.get("overallVerificationConfidence", 0.0),
+                    "raw_llm_response": raw_response_text
+                })
+
+            # Log the extracted identifiers in initial classification mode
+            if is_initial_classification and response_data.field_confidences:
+                extracted_identifiers = {}
+                for field in response_data.field_confidences:
+                    if field.extracted_value:
+                        extracted_identifiers[field.field_name] = field.extracted_value
+
+                if extracted_identifiers:
+                    logger.info(f"Extracted identifiers for job {request_data.job_no}: {extracted_identifiers}")
                 else:
-                    # Try to parse the whole response as JSON
-                    llm_output_dict = json.loads(raw_response_text)
-
-                # Convert the response to our schema format
-                if is_initial_classification:
-                    # Handle the new array format for initial classification
-                    # Check if the response is an array
-                    if isinstance(llm_output_dict, list):
-                        documents_array = llm_output_dict
-                    else:
-                        # If it's not an array, try to wrap it in an array
-                        documents_array = [llm_output_dict]
-
-                    logger.info(f"Parsed {len(documents_array)} documents from LLM response")
-
-                    # Create field confidences based on all extracted identifiers
-                    field_confidences = []
-                    document_types = []
-                    classification_reasoning = []
-
-                    for doc in documents_array:
-                        document_type = doc.get("document_type", "UNKNOWN")
-                        identifier_label = doc.get("identifier_label", "")
-                        identifier_value = doc.get("identifier_value", "")
-
-                        # Map the document type to our expected format
-                        normalized_type = "UNKNOWN"
-                        if "sales quote" in document_type.lower():
-                            normalized_type = "SalesQuote"
-                        elif "proforma invoice" in document_type.lower():
-                            normalized_type = "ProformaInvoice"
-                        elif "job shipment" in document_type.lower():
-                            normalized_type = "JobConsumption"
-
-                        document_types.append(normalized_type)
-                        classification_reasoning.append(f"{document_type} with {identifier_label}: {identifier_value}")
-
-                        if identifier_value:
-                            # Determine field name based on identifier label
-                            field_name = "Unknown"
-                            if "quote" in identifier_label.lower():
-                                field_name = "Quote No"
-                            elif "invoice" in identifier_label.lower() or "tax" in identifier_label.lower():
-                                field_name = "Invoice No"
-                            elif "shipment" in identifier_label.lower() or "job" in identifier_label.lower():
-                                field_name = "Job Shipment No"
-
-                            field_confidences.append(
-                                schemas.FieldConfidence(
+                    logger.warning(f"No identifiers extracted for job {request_data.job_no}")
+
+            # If we get here, the model worked
+            logger.info(f"Successfully used model: {model_name} for document classification and verification")
+            return response_data
+
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"JSONDecodeError with model {model_name}: {e}")
+
+            # Try to extract information from text response, taking the first document type it names
+            document_type = _sniff_document_type(raw_response_text) or "UNKNOWN"
+
+            # Try to extract document numbers if in initial classification mode
+            field_confidences = []
+            if is_initial_classification:
+                # Try to find JSON array in the text
+                array_match = _JSON_ARRAY_RE.search(raw_response_text)
+                if array_match:
+                    try:
+                        # Try to parse the JSON array
+                        json_array = orjson.loads(array_match.group(0))
+                        logger.info(f"Successfully extracted JSON array with {len(json_array)} items from text response")
+
+                        # Process each item in the array
+                        for item in json_array:
+                            doc_type = item.get("document_type", "")
+                            identifier_label = item.get("identifier_label", "")
+                            identifier_value = item.get("identifier_value", "")
+
+                            if identifier_value:
+                                field_name = _identifier_field_name(identifier_label)
+
+                                field_confidences.append(schemas.FieldConfidence(
                                     field_name=field_name,
-                                    confidence=0.9,
+                                    extraction_confidence=0.8,
                                     extracted_value=identifier_value,
                                     verified=False
-                                )
+                                ))
+
+                        # If we successfully extracted fields, determine document type
+                        if field_confidences:
+                            # Use the first document type found
+                            first_doc = json_array[0]
+                            doc_type = first_doc.get("document_type", "UNKNOWN")
+                            document_type = _normalize_doc_type(doc_type)
+
+                            # Return early with the extracted data
+                            return schemas.ClassifyAndVerifyResponse(
+                                document_type=document_type,
+                                classification_confidence=0.8,
+                                classification_reasoning=f"Extracted from partial JSON: {doc_type}",
+                                field_confidences=field_confidences,
+                                raw_llm_response=raw_response_text
                             )
-
-                    # Determine the primary document type (for backward compatibility)
-                    primary_document_type = "UNKNOWN"
-                    if "SalesQuote" in document_types:
-                        primary_document_type = "SalesQuote"
-                    elif "ProformaInvoice" in document_types:
-                        primary_document_type = "ProformaInvoice"
-                    elif "JobConsumption" in document_types:
-                        primary_document_type = "JobConsumption"
-
-                    response_data = schemas.ClassifyAndVerifyResponse(
-                        document_type=primary_document_type,
-                        classification_confidence=0.9,
-                        classification_reasoning=f"Documents identified: {', '.join(classification_reasoning)}",
+                    except orjson.JSONDecodeError:
+                        logger.warning("Found JSON-like array but failed to parse it")
+
+                # Fallback to regex extraction if JSON parsing failed, using the document type sniffed above
+                # Try to extract sales quote number (look for SQ followed by numbers)
+                quote_match = _QUOTE_NUMBER_RE.search(raw_response_text)
+                if quote_match or document_type == "SalesQuote":
+                    # If we found a quote number or the document is a sales quote, extract the identifier
+                    identifier_value = quote_match.group(1) if quote_match else ""
+                    # Look for SQ pattern if not found in the first regex
+                    if not identifier_value:
+                        sq_match = _SQ_NUMBER_RE.search(raw_response_text)
+                        identifier_value = sq_match.group(1) if sq_match else ""
+
+                    if identifier_value:
+                        field_confidences.append(schemas.FieldConfidence(
+                            field_name="Quote No",
+                            extraction_confidence=0.7,
+                            extracted_value=identifier_value,
+                            verified=False
+                        ))
+
+                # Try to extract invoice number
+                invoice_match = _INVOICE_NUMBER_RE.search(raw_response_text)
+                if invoice_match or document_type == "ProformaInvoice":
+                    # If we found an invoice number or the document is a proforma invoice, extract the identifier
+                    identifier_value = invoice_match.group(1) if invoice_match else ""
+                    if not identifier_value:
+                        # Try another pattern for invoice numbers
+                        inv_match = _LONG_NUMBER_RE.search(raw_response_text)
+                        identifier_value = inv_match.group(1) if inv_match else ""
+
+                    if identifier_value:
+                        field_confidences.append(schemas.FieldConfidence(
+                            field_name="Invoice No",
+                            extraction_confidence=0.7,
+                            extracted_value=identifier_value,
+                            verified=False
+                        ))
+
+                # Try to extract job shipment number
+                job_match = _JOB_SHIPMENT_NUMBER_RE.search(raw_response_text)
+                if job_match or document_type == "JobConsumption":
+                    identifier_value = job_match.group(1) if job_match else ""
+                    if not identifier_value:
+                        # Look for JC pattern
+                        jc_match = _JC_NUMBER_RE.search(raw_response_text)
+                        identifier_value = jc_match.group(1) if jc_match else ""
+
+                    if identifier_value:
+                        field_confidences.append(schemas.FieldConfidence(
+                            field_name="Job Shipment No",
+                            extraction_confidence=0.7,
+                            extracted_value=identifier_value,
+                            verified=False
+                        ))
+
+            # Validate extracted identifiers for business logic errors
+            if is_initial_classification and document_type != "UNKNOWN":
+                # Convert field_confidences to a dictionary for validation
+                extracted_identifiers = {}
+                for field in field_confidences:
+                    if field.extracted_value:
+                        extracted_identifiers[field.field_name] = field.extracted_value
+
+                # Validate that required identifiers were extracted
+                is_valid, validation_error = _validate_extracted_identifiers(document_type, extracted_identifiers)
+                if not is_valid:
+                    # Return business logic error for missing identifiers
+                    return schemas.ClassifyAndVerifyResponse(
+                        document_type=document_type,
+                        classification_confidence=0.5,
+                        classification_reasoning="Document classified but missing required identifiers",
                         field_confidences=field_confidences,
-                        overall_verification_confidence=0.0,
-                        raw_llm_response=raw_response_text
-                    )
-                else:
-                    # Use the original format for verification
-                    response_data = schemas.ClassifyAndVerifyResponse(
-                        document_type=llm_output_dict.get("documentType", "UNKNOWN"),
-                        classification_confidence=llm_output_dict.get("classificationConfidence", 0.0),
-                        classification_reasoning=llm_output_dict.get("classificationReasoning", "No reasoning provided"),
-                        discrepancies=[
-                            schemas.Discrepancy(**d) for d in llm_output_dict.get("discrepancies", [])
-                        ],
-                        field_confidences=[
-                            schemas.FieldConfidence(**f) for f in llm_output_dict.get("fieldConfidences", [])
-                        ],
-                        overall_verification_confidence=llm_output_dict.get("overallVerificationConfidence", 0.0),
+                        error_message=validation_error,
                         raw_llm_response=raw_response_text
                     )
 
-                # Log the extracted identifiers in initial classification mode
-                if is_initial_classification and response_data.field_confidences:
-                    extracted_identifiers = {}
-                    for field in response_data.field_confidences:
-                        if field.extracted_value:
-                            extracted_identifiers[field.field_name] = field.extracted_value
-
-                    if extracted_identifiers:
-                        logger.info(f"Extracted identifiers for job {request_data.job_no}: {extracted_identifiers}")
-                    else:
-                        logger.warning(f"No identifiers extracted for job {request_data.job_no}")
-
-                # If we get here, the model worked
-                logger.info(f"Successfully used model: {model_name} for document classification and verification")
-                return response_data
-
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSONDecodeError with model {model_name}: {e}")
-
-                # Try to extract information from text response
-                document_type = "UNKNOWN"
-                if "salesquote" in raw_response_text.lower() or "sales quote" in raw_response_text.lower():
-                    document_type = "SalesQuote"
-                elif "proformainvoice" in raw_response_text.lower() or "proforma invoice" in raw_response_text.lower():
-                    document_type = "ProformaInvoice"
-                elif "jobconsumption" in raw_response_text.lower() or "job consumption" in raw_response_text.lower() or "job shipment" in raw_response_text.lower():
-                    document_type = "JobConsumption"
-
-                # Try to extract document numbers if in initial classification mode
-                field_confidences = []
-                if is_initial_classification:
-                    # Try to find JSON array in the text
-                    array_match = re.search(r'\[\s*\{[^]]*\}\s*\]', raw_response_text)
-                    if array_match:
-                        try:
-                            # Try to parse the JSON array
-                            json_array = json.loads(array_match.group(0))
-                            logger.info(f"Successfully extracted JSON array with {len(json_array)} items from text response")
-
-                            # Process each item in the array
-                            for item in json_array:
-                                doc_type = item.get("document_type", "")
-                                identifier_label = item.get("identifier_label", "")
-                                identifier_value = item.get("identifier_value", "")
-
-                                if identifier_value:
-                                    field_name = "Unknown"
-                                    if "quote" in identifier_label.lower():
-                                        field_name = "Quote No"
-                                    elif "invoice" in identifier_label.lower() or "tax" in identifier_label.lower():
-                                        field_name = "Invoice No"
-                                    elif "shipment" in identifier_label.lower() or "job" in identifier_label.lower():
-                                        field_name = "Job Shipment No"
-
-                                    field_confidences.append(schemas.FieldConfidence(
-                                        field_name=field_name,
-                                        confidence=0.8,
-                                        extracted_value=identifier_value,
-                                        verified=False
-                                    ))
-
-                            # If we successfully extracted fields, determine document type
-                            if field_confidences:
-                                # Use the first document type found
-                                first_doc = json_array[0]
-                                doc_type = first_doc.get("document_type", "UNKNOWN")
-                                if "sales quote" in doc_type.lower():
-                                    document_type = "SalesQuote"
-                                elif "proforma invoice" in doc_type.lower():
-                                    document_type = "ProformaInvoice"
-                                elif "job shipment" in doc_type.lower():
-                                    document_type = "JobConsumption"
-                                else:
-                                    document_type = "UNKNOWN"
-
-                                # Return early with the extracted data
-                                return schemas.ClassifyAndVerifyResponse(
-                                    document_type=document_type,
-                                    classification_confidence=0.8,
-                                    classification_reasoning=f"Extracted from partial JSON: {doc_type}",
-                                    field_confidences=field_confidences,
-                                    raw_llm_response=raw_response_text
-                                )
-                        except json.JSONDecodeError:
-                            logger.warning("Found JSON-like array but failed to parse it")
-
-                    # Fallback to regex extraction if JSON parsing failed
-                    document_type = "UNKNOWN"
-                    if "sales quote" in raw_response_text.lower():
-                        document_type = "SalesQuote"
-                    elif "proforma invoice" in raw_response_text.lower():
-                        document_type = "ProformaInvoice"
-                    elif "job shipment" in raw_response_text.lower():
-                        document_type = "JobConsumption"
-
-                    # Try to extract sales quote number (look for SQ followed by numbers)
-                    quote_match = re.search(r'(?:sales\s*quote\s*number|quote\s*no|sq)[:\s]*([A-Za-z0-9]+)', raw_response_text, re.IGNORECASE)
-                    if quote_match or document_type == "SalesQuote":
-                        # If we found a quote number or the document is a sales quote, extract the identifier
-                        identifier_value = quote_match.group(1) if quote_match else ""
-                        # Look for SQ pattern if not found in the first regex
-                        if not identifier_value:
-                            sq_match = re.search(r'(SQ\d+)', raw_response_text)
-                            identifier_value = sq_match.group(1) if sq_match else ""
-
-                        if identifier_value:
-                            field_confidences.append(schemas.FieldConfidence(
-                                field_name="Quote No",
-                                confidence=0.7,
-                                extracted_value=identifier_value,
-                                verified=False
-                            ))
-
-                    # Try to extract invoice number
-                    invoice_match = re.search(r'(?:tax\s*invoice\s*number|invoice\s*no|proforma)[:\s]*(\d+)', raw_response_text, re.IGNORECASE)
-                    if invoice_match or document_type == "ProformaInvoice":
-                        # If we found an invoice number or the document is a proforma invoice, extract the identifier
-                        identifier_value = invoice_match.group(1) if invoice_match else ""
-                        if not identifier_value:
-                            # Try another pattern for invoice numbers
-                            inv_match = re.search(r'(\d{6,})', raw_response_text)
-                            identifier_value = inv_match.group(1) if inv_match else ""
-
-                        if identifier_value:
-                            field_confidences.append(schemas.FieldConfidence(
-                                field_name="Invoice No",
-                                confidence=0.7,
-                                extracted_value=identifier_value,
-                                verified=False
-                            ))
-
-                    # Try to extract job shipment number
-                    job_match = re.search(r'(?:job\s*shipment\s*no|job\s*shipment\s*number|jc)[:\s]*([A-Za-z0-9]+)', raw_response_text, re.IGNORECASE)
-                    if job_match or document_type == "JobConsumption":
-                        identifier_value = job_match.group(1) if job_match else ""
-                        if not identifier_value:
-                            # Look for JC pattern
-                            jc_match = re.search(r'(JC\d+)', raw_response_text)
-                            identifier_value = jc_match.group(1) if jc_match else ""
-
-                        if identifier_value:
-                            field_confidences.append(schemas.FieldConfidence(
-                                field_name="Job Shipment No",
-                                confidence=0.7,
-                                extracted_value=identifier_value,
-                                verified=False
-                            ))
-
-                # Validate extracted identifiers for business logic errors
-                if is_initial_classification and document_type != "UNKNOWN":
-                    # Convert field_confidences to a dictionary for validation
-                    extracted_identifiers = {}
-                    for field in field_confidences:
-                        if field.extracted_value:
-                            extracted_identifiers[field.field_name] = field.extracted_value
-
-                    # Validate that required identifiers were extracted
-                    is_valid, validation_error = _validate_extracted_identifiers(document_type, extracted_identifiers)
-                    if not is_valid:
-                        # Return business logic error for missing identifiers
-                        return schemas.ClassifyAndVerifyResponse(
-                            document_type=document_type,
-                            classification_confidence=0.5,
-                            classification_reasoning="Document classified but missing required identifiers",
-                            field_confidences=field_confidences,
-                            error_message=validation_error,
-                            raw_llm_response=raw_response_text
-                        )
-
-                # Create a basic response with the extracted document type and any extracted fields
-                return schemas.ClassifyAndVerifyResponse(
-                    document_type=document_type,
-                    classification_confidence=0.5,
-                    classification_reasoning="Extracted from text response",
-                    field_confidences=field_confidences,
-                    raw_llm_response=raw_response_text
-                )
+            # Create a basic response with the extracted document type and any extracted fields
+            return schemas.ClassifyAndVerifyResponse(
+                document_type=document_type,
+                classification_confidence=0.5,
+                classification_reasoning="Extracted from text response",
+                field_confidences=field_confidences,
+                raw_llm_response=raw_response_text
+            )
 
+    if settings.gemini_speculative_fallback:
+        # Ask every model at once and keep the best answer, instead of trying the next model only after a failure.
+        # Models cooling down come last, so they only win ties, and every outcome feeds the health stats.
+        model_names = _order_models_by_health(_MODEL_NAMES)
+        results = await asyncio.gather(*(attempt(model_name) for model_name in model_names), return_exceptions=True)
+        responses = []
+        for model_name, result in zip(model_names, results):
+            if isinstance(result, asyncio.CancelledError):
+                # An attempt cancelled from outside says nothing about the model's health, but the request
+                # itself being cancelled must not be swallowed (Task.cancelling is Python 3.11+)
+                current_task = asyncio.current_task()
+                if getattr(current_task, "cancelling", lambda: 0)():
+                    raise result
+                last_error = result
+                logger.warning(f"Attempt with model {model_name} for classification and verification was cancelled")
+            elif isinstance(result, BaseException):
+                _record_model_failure(model_name, result)
+                last_error = result
+                logger.warning(f"Failed to use model {model_name} for classification and verification: {result}")
+            else:
+                _record_model_success(model_name)
+                responses.append(result)
+        if responses:
+            # Each answer carries the raw text of the model that produced it
+            return _pick_speculative_response(responses)
+    else:
+        try:
+            return await _run_with_model_fallback(_MODEL_NAMES, attempt, "classification and verification")
         except Exception as e:
             last_error = e
-            logger.warning(f"Failed to use model {model_name} for classification and verification: {e}")
-            continue  # Try the next model
 
-    # If we get here, all models failed
+    # If we get here, all models failed. The fields are known to be valid, so skip validation on this outage path
     error_message = f"All Gemini models failed for classification and verification. Last error: {str(last_error)}"
     logger.error(error_message)
-    return schemas.ClassifyAndVerifyResponse(
+    return schemas.ClassifyAndVerifyResponse.model_construct(
         document_type="UNKNOWN",
         classification_confidence=0.0,
         error_message=error_message,
-        raw_llm_response=raw_response_text
+        raw_llm_response=last_raw_response_text
     )
 
+def _build_classification_response(classification_data: Dict[str, Any]) -> schemas.ClassificationResponse:
+    """
+    Normalizes a parsed classification result (documentType, confidence, reasoning) into a ClassificationResponse.
+    """
+    # Normalize the document type
+    if "documentType" in classification_data:
+        doc_type = classification_data["documentType"]
+        if isinstance(doc_type, str):
+            # Normalize to expected values
+            classification_data["documentType"] = _normalize_doc_type(doc_type)
+    else:
+        classification_data["documentType"] = "UNKNOWN"
+
+    # Ensure confidence is a float
+    if "confidence" in classification_data:
+        try:
+            classification_data["confidence"] = float(classification_data["confidence"])
+        except (ValueError, TypeError):
+            classification_data["confidence"] = 0.0
+    else:
+        classification_data["confidence"] = 0.0
+
+    # Ensure reasoning is a string
+    if "reasoning" not in classification_data or not classification_data["reasoning"]:
+        classification_data["reasoning"] = "No reasoning provided"
+
+    return schemas.ClassificationResponse(
+        document_type=classification_data["documentType"],
+        confidence=classification_data["confidence"],
+        reasoning=classification_data["reasoning"]
+    )
+
+def _classify_locally(request_data: schemas.ClassificationRequest) -> Optional[schemas.ClassificationResponse]:
+    """
+    Classifies a document from its supplied text when the local classifier is confident enough.
+    Returns None when the document has to go to Gemini.
+    """
+    local_result = local_classifier.classify_text(request_data.document_text)
+    if local_result is None or local_result[1] < settings.local_classifier_min_confidence:
+        return None
+
+    document_type, confidence, reasoning = local_result
+    logger.info(f"Classified document for job {request_data.job_no} locally as {document_type} (confidence {confidence})")
+    return schemas.ClassificationResponse(
+        document_type=document_type,
+        confidence=confidence,
+        reasoning=reasoning
+    )
+
+# Classifications by digest of the request's images, oldest first, and the classifications in progress.
+# The classification prompt does not depend on the request, so the same pages always get the same answer.
+_CLASSIFICATION_CACHE: "OrderedDict[bytes, schemas.ClassificationResponse]" = OrderedDict()
+_MAX_CLASSIFICATION_CACHE_ENTRIES = 1024
+_CLASSIFICATIONS_IN_FLIGHT: Dict[bytes, "asyncio.Future[schemas.ClassificationResponse]"] = {}
+
 async def classify_document_with_gemini(
     request_data: schemas.ClassificationRequest
 ) -> schemas.ClassificationResponse:
     """
     Classifies a document using Gemini.
+    Successful classifications are cached by image digest, and concurrent requests for the same
+    images share one Gemini call.
+    """
+    # Documents whose text carries an unambiguous header are classified without calling Gemini
+    local_response = _classify_locally(request_data)
+    if local_response is not None:
+        return local_response
+
+    cache_key = _document_images_digest(request_data.document_images)
+    cached_response = _lru_get(_CLASSIFICATION_CACHE, cache_key)
+    if cached_response is not None:
+        logger.info(f"Returning cached classification for job {request_data.job_no}")
+        return cached_response.model_copy()
+
+    response_data = await _single_flight(_CLASSIFICATIONS_IN_FLIGHT, cache_key, lambda: _classify_document(request_data))
+    if response_data.error_message is None and response_data.document_type != "UNKNOWN":
+        _lru_put(_CLASSIFICATION_CACHE, cache_key, response_data.model_copy(), _MAX_CLASSIFICATION_CACHE_ENTRIES)
+    return response_data
+
+async def _classify_document(
+    request_data: schemas.ClassificationRequest
+) -> schemas.ClassificationResponse:
+    """
+    Classifies a document with Gemini.
     """
     if not _vertex_ai_initialized:
         logger.error("Vertex AI not initialized. Cannot process request.")
@@ -1106,151 +2219,248 @@ async def classify_document_with_gemini(
             error_message="Vertex AI client not initialized."
         )
 
-    # List of model names to try in order of preference
-    model_names = [
-        settings.gemini_model_name,      # Try the configured model first (gemini-2.0-flash-001)
-        "gemini-2.0-flash-lite-001",     # Gemini 2.0 Flash Lite model as fallback
-    ]
+    # The classification prompt is serialized once at import
+    prompt_text = _DOC_CLASSIFICATION_PROMPT_TEXT
+    logger.debug("Gemini Classification Prompt for job %s:\n%s", request_data.job_no, prompt_text)
 
-    # Build the classification prompt
-    prompt_structure = _build_document_classification_prompt()
-    prompt_text = json.dumps(prompt_structure, indent=2)
-    logger.debug(f"Gemini Classification Prompt for job {request_data.job_no}:\n{prompt_text}")
-
-    # Build the parts for the Gemini request
-    gemini_parts = _build_gemini_parts_from_request(prompt_text, request_data.document_images)
+    # Build the parts for the Gemini request; the classification prompt is the same for every request
+    gemini_contents = _as_user_contents([_text_part(prompt_text), *await _build_image_parts(request_data.document_images)])
 
     # Configure generation parameters for better results
-    generation_config = GenerationConfig(temperature=0.1, max_output_tokens=1024)
+    generation_config = _CLASSIFICATION_GENERATION_CONFIG
 
-    # Try each model in sequence until one works
+    # Try each model in order of preference, hedging slow attempts
     last_error = None
-    raw_response_text = None
 
-    for model_name in model_names:
-        try:
-            logger.info(f"Attempting to use model: {model_name} for document classification")
-            model = GenerativeModel(model_name)
+    async def attempt(model_name: str) -> schemas.ClassificationResponse:
+        logger.info(f"Attempting to use model: {model_name} for document classification")
+        model = _get_model(model_name)
 
-            # All models in our list are vision-capable
-            response = await model.generate_content_async(gemini_parts, generation_config=generation_config)
-            raw_response_text = response.text
-            logger.debug(f"Raw model response for document classification (job {request_data.job_no}): {raw_response_text}")
+        # All models in our list are vision-capable
+        response = await _generate_content(model, gemini_contents, generation_config)
+        raw_response_text = response.text
+        logger.debug("Raw model response for document classification (job %s): %s", request_data.job_no, raw_response_text)
 
-            # Try to extract JSON from the response
-            try:
-                # First try direct JSON parsing
-                classification_data = json.loads(raw_response_text)
-            except json.JSONDecodeError:
-                # If that fails, try to extract JSON from the text
-                import re
-                json_match = re.search(r'({[\s\S]*})', raw_response_text)
-                if json_match:
-                    try:
-                        classification_data = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        # If still failing, try a more lenient approach
-                        logger.warning(f"Could not parse JSON directly. Attempting to extract classification manually.")
-                        classification_data = {}
-
-                        # Look for document type
-                        doc_type_match = re.search(r'documentType["\']?\s*:\s*["\']?(\w+)["\']?', raw_response_text)
-                        if doc_type_match:
-                            classification_data["documentType"] = doc_type_match.group(1)
-                        else:
-                            classification_data["documentType"] = "UNKNOWN"
-
-                        # Look for confidence
-                        confidence_match = re.search(r'confidence["\']?\s*:\s*([0-9.]+)', raw_response_text)
-                        if confidence_match:
-                            classification_data["confidence"] = float(confidence_match.group(1))
-                        else:
-                            classification_data["confidence"] = 0.0
-
-                        # Look for reasoning
-                        reasoning_match = re.search(r'reasoning["\']?\s*:\s*["\']?(.*?)["\']?[,}]', raw_response_text)
-                        if reasoning_match:
-                            classification_data["reasoning"] = reasoning_match.group(1)
-                        else:
-                            classification_data["reasoning"] = "No reasoning provided"
-                else:
-                    # If we can't extract JSON, look for keywords in the response
-                    if "salesquote" in raw_response_text.lower() or "sales quote" in raw_response_text.lower():
-                        classification_data = {"documentType": "SalesQuote", "confidence": 0.7, "reasoning": "Extracted from text response"}
-                    elif "proformainvoice" in raw_response_text.lower() or "proforma invoice" in raw_response_text.lower():
-                        classification_data = {"documentType": "ProformaInvoice", "confidence": 0.7, "reasoning": "Extracted from text response"}
-                    elif "jobconsumption" in raw_response_text.lower() or "job consumption" in raw_response_text.lower() or "job shipment" in raw_response_text.lower():
-                        classification_data = {"documentType": "JobConsumption", "confidence": 0.7, "reasoning": "Extracted from text response"}
-                    else:
-                        classification_data = {"documentType": "UNKNOWN", "confidence": 0.0, "reasoning": "Could not determine document type"}
-
-            # Normalize the document type
-            if "documentType" in classification_data:
-                doc_type = classification_data["documentType"]
-                if isinstance(doc_type, str):
-                    doc_type = doc_type.strip()
-                    # Normalize to expected values
-                    if doc_type.lower() in ["salesquote", "sales quote", "sq"]:
-                        classification_data["documentType"] = "SalesQuote"
-                    elif doc_type.lower() in ["proformainvoice", "proforma invoice", "proforma", "pi"]:
-                        classification_data["documentType"] = "ProformaInvoice"
-                    elif doc_type.lower() in ["jobconsumption", "job consumption", "job shipment", "jobshipment", "jc"]:
-                        classification_data["documentType"] = "JobConsumption"
-                    else:
-                        classification_data["documentType"] = "UNKNOWN"
-            else:
-                classification_data["documentType"] = "UNKNOWN"
-
-            # Ensure confidence is a float
-            if "confidence" in classification_data:
-                try:
-                    classification_data["confidence"] = float(classification_data["confidence"])
-                except (ValueError, TypeError):
-                    classification_data["confidence"] = 0.0
-            else:
-                classification_data["confidence"] = 0.0
+        # JSON mode guarantees a complete object unless the output was cut off
+        try:
+            classification_data = orjson.loads(raw_response_text)
+        except orjson.JSONDecodeError:
+            logger.warning(f"Could not parse classification JSON for job {request_data.job_no}.")
+            classification_data = {"documentType": "UNKNOWN", "confidence": 0.0, "reasoning": "Could not determine document type"}
 
-            # Ensure reasoning is a string
-            if "reasoning" not in classification_data or not classification_data["reasoning"]:
-                classification_data["reasoning"] = "No reasoning provided"
+        # If we get here, the model worked
+        logger.info(f"Successfully used model: {model_name} for document classification")
+        return _build_classification_response(classification_data)
 
-            # If we get here, the model worked
-            logger.info(f"Successfully used model: {model_name} for document classification")
-            return schemas.ClassificationResponse(
-                document_type=classification_data["documentType"],
-                confidence=classification_data["confidence"],
-                reasoning=classification_data["reasoning"]
-            )
-
-        except Exception as e:
-            last_error = e
-            logger.warning(f"Failed to use model {model_name} for document classification: {e}")
-            continue  # Try the next model
+    try:
+        return await _run_with_model_fallback(_MODEL_NAMES, attempt, "document classification")
+    except Exception as e:
+        last_error = e
 
-    # If we get here, all models failed
+    # If we get here, all models failed. The fields are known to be valid, so skip validation on this outage path
     error_message = f"All Gemini models failed for document classification. Last error: {str(last_error)}"
     logger.error(error_message)
-    return schemas.ClassificationResponse(
+    return schemas.ClassificationResponse.model_construct(
         document_type="UNKNOWN",
         confidence=0.0,
         error_message=error_message
     )
 
+# Upper bound on documents sent to Gemini in one batched classification call
+_MAX_CLASSIFICATION_BATCH_SIZE = 16
+
+async def classify_documents_with_gemini(
+    requests: List[schemas.ClassificationRequest]
+) -> List[schemas.ClassificationResponse]:
+    """
+    Classifies several documents with as few Gemini calls as possible.
+    Documents are sent in chunks of up to _MAX_CLASSIFICATION_BATCH_SIZE, each chunk as one
+    multimodal request, and the results are returned in the same order as the input.
+    Documents the local classifier can settle from their text are not sent to Gemini.
+    """
+    results: List[Optional[schemas.ClassificationResponse]] = [_classify_locally(r) for r in requests]
+    pending = [index for index, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    if not _vertex_ai_initialized:
+        logger.error("Vertex AI not initialized. Cannot process request.")
+        for index in pending:
+            results[index] = schemas.ClassificationResponse(document_type="UNKNOWN", confidence=0.0, error_message="Vertex AI client not initialized.")
+        return results
+
+    pending_requests = [requests[index] for index in pending]
+    chunks = [
+        pending_requests[i:i + _MAX_CLASSIFICATION_BATCH_SIZE]
+        for i in range(0, len(pending_requests), _MAX_CLASSIFICATION_BATCH_SIZE)
+    ]
+    chunk_results = await asyncio.gather(*(_classify_document_chunk(chunk) for chunk in chunks))
+    gemini_results = [response for chunk_result in chunk_results for response in chunk_result]
+    for index, response in zip(pending, gemini_results):
+        results[index] = response
+    return results
+
+@functools.lru_cache(maxsize=_MAX_CLASSIFICATION_BATCH_SIZE)
+def _batch_classification_prompt_text(document_count: int) -> str:
+    """
+    Serializes the batch classification prompt for a chunk of document_count documents.
+    Only the count varies between chunks, so each size is built and serialized once.
+    """
+    # The single-document prompt, extended to describe the per-document markers and the array output
+    prompt_structure = dict(_build_document_classification_prompt())
+    prompt_structure["batchInstructions"] = [
+        f"The images belong to {document_count} separate documents.",
+        "The images of each document are preceded by a marker of the form '--- DOCUMENT <index> ---', starting at index 0.",
+        "Classify each document independently.",
+        "Return a JSON array with exactly one object per document, in document order, each shaped like 'outputFormat' plus a 'documentIndex' field."
+    ]
+    return orjson.dumps(prompt_structure).decode()
+
+async def _classify_document_chunk(
+    requests: List[schemas.ClassificationRequest]
+) -> List[schemas.ClassificationResponse]:
+    """
+    Classifies one chunk of documents with a single Gemini call.
+    """
+    gemini_parts = [_text_part(_batch_classification_prompt_text(len(requests)))]
+    for index, request_data in enumerate(requests):
+        gemini_parts.append(_text_part(f"--- DOCUMENT {index} ---"))
+        gemini_parts.extend(await _build_image_parts(request_data.document_images))
+    gemini_contents = _as_user_contents(gemini_parts)
+
+    generation_config = GenerationConfig(temperature=0.1, max_output_tokens=512 + 256 * len(requests))
+
+    # Try each model in order of preference, hedging slow attempts
+    last_error = None
+
+    async def attempt(model_name: str) -> List[schemas.ClassificationResponse]:
+        logger.info(f"Attempting to use model: {model_name} for batch classification of {len(requests)} documents")
+        model = _get_model(model_name)
+        response = await _generate_content(model, gemini_contents, generation_config)
+        raw_response_text = response.text
+
+        try:
+            results_data = orjson.loads(raw_response_text)
+        except orjson.JSONDecodeError:
+            # Strip any prose or markdown fence around the array
+            start, end = raw_response_text.find("["), raw_response_text.rfind("]")
+            if start < 0 or end < start:
+                raise
+            results_data = orjson.loads(raw_response_text[start:end + 1])
+        if not isinstance(results_data, list):
+            raise ValueError(f"Expected a JSON array of classifications, got: {type(results_data).__name__}")
+
+        by_index = {}
+        for position, item in enumerate(results_data):
+            if isinstance(item, dict):
+                by_index.setdefault(item.get("documentIndex", position), item)
+
+        responses = []
+        for index in range(len(requests)):
+            item = by_index.get(index)
+            if item is None:
+                responses.append(schemas.ClassificationResponse(
+                    document_type="UNKNOWN",
+                    confidence=0.0,
+                    error_message="Model returned no classification for this document"
+                ))
+            else:
+                responses.append(_build_classification_response(item))
+
+        logger.info(f"Successfully used model: {model_name} for batch classification")
+        return responses
+
+    try:
+        return await _run_with_model_fallback(_MODEL_NAMES, attempt, "batch classification")
+    except Exception as e:
+        last_error = e
+
+    error_message = f"All Gemini models failed for batch classification. Last error: {str(last_error)}"
+    logger.error(error_message)
+    return [
+        schemas.ClassificationResponse.model_construct(document_type="UNKNOWN", confidence=0.0, error_message=error_message)
+        for _ in requests
+    ]
+
+# Response schema for single-document verification. It pins the keys and value types to those of
+# VerificationResponse, so the JSON-mode answer validates without any text recovery
+_VERIFICATION_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "discrepancies": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "discrepancy_type": {"type": "string", "enum": ["MISSING_IN_DOCUMENT", "UNEXPECTED_IN_DOCUMENT", "FORMAT_ERROR", "VALUE_MISMATCH_FUZZY"]},
+                    "field_name": {"type": "string"},
+                    "document_value": {"type": "string", "nullable": True},
+                    "erp_value": {"type": "string", "nullable": True},
+                    "severity": {"type": "string", "enum": ["high", "medium", "low"]},
+                    "description": {"type": "string", "nullable": True},
+                },
+                "required": ["discrepancy_type", "field_name"],
+            },
+        },
+        "field_confidences": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "field_name": {"type": "string"},
+                    "extracted_value": {"type": "string", "nullable": True},
+                    "extraction_confidence": {"type": "number"},
+                    "match_assessment_confidence": {"type": "number", "nullable": True},
+                },
+                "required": ["field_name", "extraction_confidence"],
+            },
+        },
+        "overall_verification_confidence": {"type": "number"},
+    },
+    "required": ["discrepancies", "field_confidences", "overall_verification_confidence"],
+}
+
+# Generation parameters for single-document verification, with the top_p/top_k variant used for Gemini 2.0 models
+_VERIFICATION_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1,
+    max_output_tokens=4096,
+    response_mime_type="application/json",
+    response_schema=_VERIFICATION_RESPONSE_SCHEMA
+)
+_VERIFICATION_GEMINI_2_GENERATION_CONFIG = GenerationConfig(
+    temperature=0.1,
+    max_output_tokens=4096,
+    top_p=0.95,
+    top_k=40,
+    response_mime_type="application/json",
+    response_schema=_VERIFICATION_RESPONSE_SCHEMA
+)
+
+# Verifications by digest of the prompt (which carries the job and ERP data) and the images, oldest
+# first, and the verifications in progress
+_VERIFICATION_CACHE: "OrderedDict[bytes, schemas.VerificationResponse]" = OrderedDict()
+_MAX_VERIFICATION_CACHE_ENTRIES = 256
+_VERIFICATIONS_IN_FLIGHT: Dict[bytes, "asyncio.Future[schemas.VerificationResponse]"] = {}
+
+def _verification_prompt_and_cache_key(request_data: schemas.VerificationRequest) -> Tuple[str, bytes]:
+    """Returns a document's verification prompt text and its key in _VERIFICATION_CACHE."""
+    # Convert the prompt structure to compact JSON; indentation only inflates the ERP payload
+    prompt_text = orjson.dumps(_build_verification_prompt(request_data)).decode()
+    cache_key = hashlib.blake2b(prompt_text.encode(), digest_size=16).digest() + _document_images_digest(request_data.document_images)
+    return prompt_text, cache_key
+
 async def verify_document_with_gemini(
     request_data: schemas.VerificationRequest
 ) -> schemas.VerificationResponse:
     """
     Verifies document content against ERP data using Gemini.
+    Verifications whose JSON parsed are cached by prompt and image digest, and concurrent identical
+    requests share one Gemini call.
     """
     if not _vertex_ai_initialized:
         logger.error("Vertex AI not initialized. Cannot process request.")
         return schemas.VerificationResponse(error_message="Vertex AI client not initialized.")
 
-    # List of model names to try in order of preference
-    model_names = [
-        settings.gemini_model_name,      # Try the configured model first (gemini-2.0-flash-001)
-        "gemini-2.0-flash-lite-001",     # Gemini 2.0 Flash Lite model as fallback
-    ]
 
     # Use the comprehensive cross-document verification prompt
     document_type = request_data.document_type.lower()
@@ -1264,122 +2474,262 @@ async def verify_document_with_gemini(
             field_confidences=[],
             overall_verification_confidence=0.0
         )
-    else:
-        # Use the existing document-specific prompts for individual document verification
-        prompt_structure = None # Initialize prompt_structure
-        if document_type == "salesquote":
-            prompt_structure = _build_sales_quote_prompt(request_data.job_no, request_data.erp_data)
-        elif document_type == "proformainvoice":
-            prompt_structure = _build_proforma_invoice_prompt(request_data.job_no, request_data.erp_data)
-        elif document_type == "jobconsumption":
-            prompt_structure = _build_job_consumption_prompt(request_data.job_no, request_data.erp_data)
-        else:
-            logger.warning(f"Unknown document type: {document_type}. Using generic verification prompt.")
-            # Fallback to a generic verification prompt
-            output_schema_description = schemas.VerificationResponse.model_json_schema()
-            prompt_structure = {
-                "task_description": "Verify the provided document against the given ERP data. Identify discrepancies, assess confidence levels for extracted and verified fields, and determine an overall verification confidence.",
-                "document_type_context": request_data.document_type,
-                "job_number_context": request_data.job_no,
-                "erp_data_for_comparison": request_data.erp_data,
-                "instructions": "Carefully analyze the document image(s). Extract relevant header and line item information. "
-                                "Compare the extracted information field by field against the 'erp_data_for_comparison'. "
-                                "Report all discrepancies found, including value mismatches, fields missing in the document, or fields unexpectedly present in the document. "
-                                "For each key field, provide your confidence in its extraction and verification. "
-                                "Finally, provide an overall confidence score for the document verification.",
-                "required_output_format": "Return a single JSON object strictly adhering to the following schema. Do not add any extra text or explanations outside this JSON object.",
-                "output_json_schema_definition": output_schema_description
-            }
 
-    # Handle the prompt appropriately based on type
-    if isinstance(prompt_structure, str):
-        # If it's already a string (for combined verification), use it directly
-        prompt_text = prompt_structure
-        logger.debug(f"Using text prompt for combined verification for job {request_data.job_no}")
-    else:
-        # Otherwise, convert the prompt structure to JSON
-        prompt_text = json.dumps(prompt_structure, indent=2)
-        logger.debug(f"Gemini Verification Prompt for job {request_data.job_no}:\n{prompt_text[:500]}...")
+    prompt_text, cache_key = _verification_prompt_and_cache_key(request_data)
+    logger.debug("Gemini Verification Prompt for job %s:\n%.500s...", request_data.job_no, prompt_text)
 
-    # Build the parts for the Gemini request
-    gemini_parts = _build_gemini_parts_from_request(prompt_text, request_data.document_images)
+    cached_response = _lru_get(_VERIFICATION_CACHE, cache_key)
+    if cached_response is not None:
+        logger.info(f"Returning cached verification for job {request_data.job_no}")
+        return cached_response.model_copy(deep=True)
 
-    # Configure generation parameters for better results
-    generation_config = GenerationConfig(temperature=0.1, max_output_tokens=4096)
+    # Build the parts for the Gemini request
+    gemini_contents = _as_user_contents(await _build_gemini_parts_from_request(prompt_text, request_data.document_images))
 
-    # Try each model in sequence until one works
+    # Try each model in order of preference, hedging slow attempts
     last_error = None
     raw_response_text = None
 
-    for model_name in model_names:
-        try:
-            logger.info(f"Attempting to use model: {model_name} for document verification")
-            model = GenerativeModel(model_name)
-
-            # All models in our list are vision-capable
-            # Configure generation parameters for Gemini 2.0 models
-            if "gemini-2.0" in model_name:
-                # Gemini 2.0 models may need specific configuration
-                generation_config = GenerationConfig(
-                    temperature=0.1,
-                    max_output_tokens=4096,
-                    top_p=0.95,
-                    top_k=40
-                )
+    async def attempt(model_name: str) -> schemas.VerificationResponse:
+        nonlocal raw_response_text
+        logger.info(f"Attempting to use model: {model_name} for document verification")
+        model = _get_model(model_name)
 
-            # Use the full multimodal request for all models
-            response = await model.generate_content_async(gemini_parts, generation_config=generation_config)
+        # All models in our list are vision-capable
+        # Gemini 2.0 models may need specific configuration
+        if model_name.startswith("gemini-2.0"):
+            model_generation_config = _VERIFICATION_GEMINI_2_GENERATION_CONFIG
+        else:
+            model_generation_config = _VERIFICATION_GENERATION_CONFIG
 
-            raw_response_text = response.text
-            logger.debug(f"Raw model response for verification (job {request_data.job_no}): {raw_response_text}")
+        # Use the full multimodal request for all models, streaming until the JSON object is complete
+        raw_response_text = await _generate_json_text(model, gemini_contents, model_generation_config)
+        logger.debug("Raw model response for verification (job %s): %s", request_data.job_no, raw_response_text)
 
-            # Try to extract JSON from the response, handling potential text wrapping
-            try:
-                # First try direct JSON parsing
-                llm_output_dict = json.loads(raw_response_text)
-            except json.JSONDecodeError:
-                # If that fails, try to extract JSON from the text
-                import re
-                json_match = re.search(r'({[\s\S]*})', raw_response_text)
-                if json_match:
-                    try:
-                        llm_output_dict = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        # If still failing, create a minimal response
-                        logger.warning(f"Could not parse JSON from verification response. Creating minimal response.")
-                        llm_output_dict = {
-                            "discrepancies": [],
-                            "field_confidences": [],
-                            "overall_verification_confidence": 0.0
-                        }
-                else:
-                    raise ValueError(f"Could not extract JSON from response: {raw_response_text}")
+        # JSON mode guarantees a complete object unless the output was cut off
+        parsed = True
+        try:
+            llm_output_dict = orjson.loads(raw_response_text)
+        except orjson.JSONDecodeError:
+            # If the JSON does not parse, create a minimal response
+            logger.warning("Could not parse JSON from verification response. Creating minimal response.")
+            parsed = False
+            llm_output_dict = {
+                "discrepancies": [],
+                "field_confidences": [],
+                "overall_verification_confidence": 0.0
+            }
 
-            # Convert the response to our schema format
-            verification_response = schemas.VerificationResponse(
-                discrepancies=[schemas.Discrepancy(**d) for d in llm_output_dict.get("discrepancies", [])],
-                field_confidences=[schemas.FieldConfidence(**f) for f in llm_output_dict.get("field_confidences", [])],
-                overall_verification_confidence=llm_output_dict.get("overall_verification_confidence", 0.0),
-                raw_llm_response=raw_response_text
-            )
+        # Convert the response to our schema format in a single validation pass over the whole tree
+        verification_response = schemas.VerificationResponse.model_validate({
+            "discrepancies": llm_output_dict.get("discrepancies", []),
+            "field_confidences": llm_output_dict.get("field_confidences", []),
+            "overall_verification_confidence": llm_output_dict.get("overall_verification_confidence", 0.0),
+            "raw_llm_response": raw_response_text
+        })
 
-            # If we get here, the model worked
-            logger.info(f"Successfully used model: {model_name} for document verification")
-            return verification_response
+        # If we get here, the model worked; a minimal response is not worth remembering
+        logger.info(f"Successfully used model: {model_name} for document verification")
+        if parsed:
+            _lru_put(_VERIFICATION_CACHE, cache_key, verification_response.model_copy(deep=True), _MAX_VERIFICATION_CACHE_ENTRIES)
+        return verification_response
 
-        except json.JSONDecodeError as e:
-            last_error = e
-            logger.warning(f"JSONDecodeError with model {model_name}: {e}")
-            continue  # Try the next model
-        except Exception as e:
-            last_error = e
-            logger.warning(f"Failed to use model {model_name} for verification: {e}")
-            continue  # Try the next model
+    try:
+        return await _single_flight(
+            _VERIFICATIONS_IN_FLIGHT,
+            cache_key,
+            lambda: _run_with_model_fallback(_MODEL_NAMES, attempt, "document verification")
+        )
+    except Exception as e:
+        last_error = e
 
-    # If we get here, all models failed
+    # If we get here, all models failed. The fields are known to be valid, so skip validation on this outage path
     error_message = f"All Gemini models failed for document verification. Last error: {str(last_error)}"
     logger.error(error_message)
-    return schemas.VerificationResponse(
+    return schemas.VerificationResponse.model_construct(
         error_message=error_message,
         raw_llm_response=raw_response_text
     )
+
+# Verification of several documents in one call: each document's own prompt and images follow a marker
+_VERIFICATION_BUNDLE_PROMPT = """
+The request contains several separate documents to verify. Each document starts with a marker of the form
+'--- DOCUMENT <index>: <document type> ---', starting at index 0, followed by that document's verification
+prompt as JSON and then its images. Verify each document independently, using only its own prompt, ERP data
+and images. Return a JSON array with one object per document, in document order, each with the document's
+index as 'documentIndex' and that document's verification result.
+"""
+_VERIFICATION_BUNDLE_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "documentIndex": {"type": "integer"},
+            **_VERIFICATION_RESPONSE_SCHEMA["properties"],
+        },
+        "required": ["documentIndex", *_VERIFICATION_RESPONSE_SCHEMA["required"]],
+    },
+}
+# Output tokens allowed per document and in total, and the resulting upper bound on documents verified
+# in one call, so that every document keeps the single-verification budget.
+# 8192 is the output limit of the Gemini 2.0 Flash models.
+_VERIFICATION_BUNDLE_TOKENS_PER_DOCUMENT = 4096
+_VERIFICATION_BUNDLE_MAX_OUTPUT_TOKENS = 8192
+_MAX_VERIFICATION_BUNDLE_SIZE = _VERIFICATION_BUNDLE_MAX_OUTPUT_TOKENS // _VERIFICATION_BUNDLE_TOKENS_PER_DOCUMENT
+
+async def verify_documents_with_gemini(
+    requests: List[schemas.VerificationRequest]
+) -> List[schemas.VerificationResponse]:
+    """
+    Verifies several documents against their ERP data with as few Gemini calls as possible.
+    Documents are sent in bundles of up to _MAX_VERIFICATION_BUNDLE_SIZE, each bundle as one multimodal
+    request, and the results are returned in the same order as the input. Cached documents are answered
+    from _VERIFICATION_CACHE, and combined-verification requests, documents already being verified,
+    repeats within the input, and documents that a bundle's answer did not cover or whose bundle failed
+    go through verify_document_with_gemini on their own. Bundled documents count as in flight, so
+    concurrent single verifications of them share the bundle's answer.
+    """
+    results: List[Optional[schemas.VerificationResponse]] = [None] * len(requests)
+    if not _vertex_ai_initialized:
+        logger.error("Vertex AI not initialized. Cannot process request.")
+        return [schemas.VerificationResponse(error_message="Vertex AI client not initialized.") for _ in requests]
+
+    bundled = []
+    prompts_and_keys = {}
+    bundled_keys = set()
+    for index, request_data in enumerate(requests):
+        if request_data.document_type.lower() in ("combined", "all"):
+            continue
+        prompt_text, cache_key = _verification_prompt_and_cache_key(request_data)
+        cached_response = _lru_get(_VERIFICATION_CACHE, cache_key)
+        if cached_response is not None:
+            logger.info(f"Returning cached verification for job {request_data.job_no}")
+            results[index] = cached_response.model_copy(deep=True)
+        elif cache_key not in _VERIFICATIONS_IN_FLIGHT and cache_key not in bundled_keys:
+            bundled.append(index)
+            prompts_and_keys[index] = (prompt_text, cache_key)
+            bundled_keys.add(cache_key)
+    bundles = [
+        bundled[i:i + _MAX_VERIFICATION_BUNDLE_SIZE]
+        for i in range(0, len(bundled), _MAX_VERIFICATION_BUNDLE_SIZE)
+    ]
+    # A bundle of one document is just a single verification, which is cached
+    bundles = [bundle for bundle in bundles if len(bundle) > 1]
+
+    # While its bundle runs, each document counts as in flight, so a concurrent verification of the
+    # same document waits for this answer instead of calling Gemini itself
+    loop = asyncio.get_running_loop()
+    in_flight: Dict[int, "asyncio.Future[schemas.VerificationResponse]"] = {}
+    for bundle in bundles:
+        for index in bundle:
+            in_flight[index] = _VERIFICATIONS_IN_FLIGHT[prompts_and_keys[index][1]] = loop.create_future()
+
+    try:
+        bundle_results = await asyncio.gather(
+            *(
+                _verify_document_bundle(
+                    [requests[index] for index in bundle],
+                    [prompts_and_keys[index][0] for index in bundle]
+                )
+                for bundle in bundles
+            ),
+            return_exceptions=True
+        )
+        for bundle, bundle_result in zip(bundles, bundle_results):
+            if isinstance(bundle_result, BaseException):
+                # All models failed for this bundle; its documents are verified on their own below
+                logger.warning(f"Bundled verification of {len(bundle)} documents failed, verifying individually: {bundle_result}")
+                continue
+            for index, response in zip(bundle, bundle_result):
+                results[index] = response
+                if response is not None:
+                    _lru_put(_VERIFICATION_CACHE, prompts_and_keys[index][1], response.model_copy(deep=True), _MAX_VERIFICATION_CACHE_ENTRIES)
+
+        # Answered documents are handed to their waiters. The others leave the in-flight table before they
+        # are verified on their own, which registers them again, and their waiters get that answer.
+        for index, future in in_flight.items():
+            if _VERIFICATIONS_IN_FLIGHT.get(prompts_and_keys[index][1]) is future:
+                del _VERIFICATIONS_IN_FLIGHT[prompts_and_keys[index][1]]
+            if results[index] is not None:
+                future.set_result(results[index])
+
+        remaining = [index for index, result in enumerate(results) if result is None]
+        single_results = await asyncio.gather(*(verify_document_with_gemini(requests[index]) for index in remaining))
+        for index, response in zip(remaining, single_results):
+            results[index] = response
+    finally:
+        for index, future in in_flight.items():
+            if _VERIFICATIONS_IN_FLIGHT.get(prompts_and_keys[index][1]) is future:
+                del _VERIFICATIONS_IN_FLIGHT[prompts_and_keys[index][1]]
+            if future.done():
+                continue
+            if results[index] is not None:
+                future.set_result(results[index])
+            else:
+                # This call was cancelled before the document was verified
+                future.set_exception(RuntimeError("Bundled verification was cancelled"))
+                future.exception()  # Nobody may be waiting; don't log the error as unretrieved
+    return results
+
+async def _verify_document_bundle(
+    requests: List[schemas.VerificationRequest],
+    prompt_texts: List[str]
+) -> List[Optional[schemas.VerificationResponse]]:
+    """
+    Verifies a bundle of documents, given with their verification prompts, as a single Gemini call.
+    Returns one response per document, or None
+    for documents the combined answer did not cover, which the caller verifies on their own.
+    Raises if every model fails.
+    """
+    gemini_parts = [_text_part(_VERIFICATION_BUNDLE_PROMPT)]
+    for index, (request_data, prompt_text) in enumerate(zip(requests, prompt_texts)):
+        gemini_parts.append(_text_part(f"--- DOCUMENT {index}: {request_data.document_type} ---"))
+        gemini_parts.append(Part.from_text(prompt_text))
+        gemini_parts.extend(await _build_image_parts(request_data.document_images))
+    gemini_contents = _as_user_contents(gemini_parts)
+
+    generation_config = GenerationConfig(
+        temperature=0.1,
+        max_output_tokens=_VERIFICATION_BUNDLE_TOKENS_PER_DOCUMENT * len(requests),
+        top_p=0.95,
+        top_k=40,
+        response_mime_type="application/json",
+        response_schema=_VERIFICATION_BUNDLE_RESPONSE_SCHEMA
+    )
+
+    async def attempt(model_name: str) -> str:
+        logger.info(f"Attempting to use model: {model_name} for bundled verification of {len(requests)} documents")
+        response = await _generate_content(_get_model(model_name), gemini_contents, generation_config)
+        return response.text
+
+    raw_response_text = await _run_with_model_fallback(_MODEL_NAMES, attempt, "bundled document verification")
+
+    results_by_index = {}
+    try:
+        results = orjson.loads(raw_response_text)
+    except orjson.JSONDecodeError:
+        logger.warning(f"Could not parse bundled verification response, verifying {len(requests)} documents individually")
+        results = []
+    for result in results if isinstance(results, list) else []:
+        if isinstance(result, dict) and isinstance(result.get("documentIndex"), int):
+            results_by_index.setdefault(result["documentIndex"], result)
+
+    responses = []
+    for index in range(len(requests)):
+        result = results_by_index.get(index)
+        if result is None:
+            responses.append(None)
+            continue
+        try:
+            responses.append(schemas.VerificationResponse.model_validate({
+                "discrepancies": result.get("discrepancies", []),
+                "field_confidences": result.get("field_confidences", []),
+                "overall_verification_confidence": result.get("overall_verification_confidence", 0.0),
+                # Only this document's entry, not the other documents' results
+                "raw_llm_response": orjson.dumps(result).decode()
+            }))
+        except ValidationError as e:
+            # A malformed entry is verified on its own rather than failing the whole bundle
+            logger.warning(f"Invalid bundled verification result for document {index}: {e}")
+            responses.append(None)
+    return responses
@@ -6,10 +6,12 @@ This script sets up the necessary environment and runs the FastAPI application.
 
 import os
 import sys
-import subprocess
 import argparse
 from pathlib import Path
 
+import uvicorn
+from dotenv import load_dotenv
+
 def setup_environment():
     """Set up the environment variables needed for the service."""
     # Get the absolute path to the .env file
@@ -21,14 +23,9 @@ def setup_environment():
         print("See .env.example for the required variables.")
         return False
     
-    # Read the .env file and set environment variables
-    with open(env_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            key, value = line.split('=', 1)
-            os.environ[key] = value
+    # Load the .env file into the environment; variables already set in the shell take precedence,
+    # as they do for the service's own settings
+    load_dotenv(env_file, override=False)
     
     # Check for required environment variables
     required_vars = ['GCP_PROJECT_ID', 'GCP_LOCATION', 'MODEL_NAME']
@@ -42,19 +39,11 @@ def setup_environment():
     return True
 
 def run_service(host='127.0.0.1', port=8000, reload=True):
-    """Run the FastAPI service using uvicorn."""
-    cmd = [
-        "uvicorn", 
-        "app.main:app", 
-        "--host", host, 
-        "--port", str(port)
-    ]
-    
-    if reload:
-        cmd.append("--reload")
-    
+    """Run the FastAPI service using uvicorn, in this process."""
     print(f"Starting Gemini Python microservice on http://{host}:{port}")
-    subprocess.run(cmd)
+    # The app is passed as an import string so that --reload can re-import it; uvicorn's default
+    # 'auto' loop and HTTP parser pick uvloop and httptools wherever they are available
+    uvicorn.run("app.main:app", host=host, port=port, reload=reload)
 
 def main():
     parser = argparse.ArgumentParser(description='Run the Gemini Python microservice locally')